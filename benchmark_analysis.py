@@ -0,0 +1,99 @@
+import contextlib
+import io
+import sys
+import time
+from typing import Any
+
+import numpy as np
+
+import rgb_light_control
+
+BENCHMARK_COLORS: list[tuple[int, int, int]] = [(0, 100, 100), (240, 100, 100)]
+BENCHMARK_SEND_DELAY = 0.05
+MATCH_WINDOW = 0.05  # Cues within this many seconds of each other are considered the same cue
+
+
+def time_analysis(file: str, profile: str, repeats: int) -> tuple[float, dict[str, Any]]:
+    """Time how long analyzing a music file takes with a profile.
+
+    Args:
+        file: The path to the music file to analyze.
+        profile: The analysis profile to use.
+        repeats: Number of times to analyze the file. The fastest time is reported.
+
+    Returns:
+        A tuple containing the fastest time to analyze the file in seconds, and the analysis itself.
+    """
+    best = float("inf")
+    analysis = {}
+    for _ in range(repeats):
+        start = time.perf_counter()
+        analysis = rgb_light_control.analyze_music(file, rgb_light_control.MUSIC_MODES, profile)
+        best = min(best, time.perf_counter() - start)
+    return best, analysis
+
+
+def cue_deviation(reference: list[float], other: list[float]) -> np.ndarray:
+    """Get how far each reference cue is from the closest cue in another list of cues.
+
+    Args:
+        reference: Sorted cue times in seconds to compare against.
+        other: Sorted cue times in seconds to compare.
+
+    Returns:
+        An array of the absolute deviations in seconds, one per reference cue.
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    other = np.asarray(other, dtype=np.float64)
+    if len(reference) == 0 or len(other) == 0:
+        return np.full(len(reference), np.inf)
+    right = np.clip(np.searchsorted(other, reference), 0, len(other) - 1)
+    left = np.clip(right - 1, 0, len(other) - 1)
+    return np.minimum(np.abs(other[left] - reference), np.abs(other[right] - reference))
+
+
+def benchmark_file(file: str, repeats: int):
+    """Benchmark every analysis profile against the default profile for a music file, printing the results.
+
+    Args:
+        file: The path to the music file to benchmark with.
+        repeats: Number of times to analyze the file with each profile.
+    """
+    print(f"{file}:")
+    results = {}
+    for profile in rgb_light_control.ANALYSIS_PROFILES:
+        results[profile] = time_analysis(file, profile, repeats)
+    default_time, default_analysis = results["default"]
+    for profile, (profile_time, analysis) in results.items():
+        print(f"  {profile}: {profile_time:.2f}s to analyze ({default_time / profile_time:.2f}x speedup)")
+        for mode in rgb_light_control.MUSIC_MODES:
+            colors = BENCHMARK_COLORS if mode == "gradient" else BENCHMARK_COLORS[:1]
+            # Silence the light switch counts timings_from_analysis() prints
+            with contextlib.redirect_stdout(io.StringIO()):
+                default_times = rgb_light_control.timings_from_analysis(mode, colors, default_analysis,
+                                                                        BENCHMARK_SEND_DELAY)[0]
+                times = rgb_light_control.timings_from_analysis(mode, colors, analysis, BENCHMARK_SEND_DELAY)[0]
+            deviation = cue_deviation(default_times, times) * 1000
+            matched = np.mean(deviation <= MATCH_WINDOW * 1000) * 100 if len(deviation) > 0 else 0
+            print(f"    {mode}: {len(times)} cues vs. {len(default_times)}, deviation mean "
+                  f"{np.mean(deviation):.1f}ms, median {np.median(deviation):.1f}ms, "
+                  f"p95 {np.percentile(deviation, 95):.1f}ms, {matched:.0f}% within {MATCH_WINDOW * 1000:.0f}ms")
+
+
+def main():
+    """Main entrypoint"""
+    args = sys.argv[1:]
+    repeats = rgb_light_control.pop_int_option(args, "repeats", 3)
+    if len(args) == 0 or repeats < 1:
+        print("Please specify one or more music files to benchmark with, and optionally, --repeats=N to analyze each "
+              "file N times with each profile.")
+        sys.exit(1)
+    # Analyze once first so one-time setup, such as librosa's JIT compilation, doesn't count against any profile
+    with contextlib.redirect_stdout(io.StringIO()):
+        rgb_light_control.analyze_music(args[0])
+    for file in args:
+        benchmark_file(file, repeats)
+
+
+if __name__ == "__main__":
+    main()
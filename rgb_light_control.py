@@ -1,8 +1,15 @@
 from kasa import SmartBulb
 import asyncio
 from typing import Any, Union
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import hashlib
 import sys
 import os
+import json
+import tempfile
+import threading
 import colorsys
 import librosa
 from pygame.mixer import music
@@ -11,6 +18,34 @@ import time
 import numpy as np
 
 bulbs: list[SmartBulb] = []
+bulb_groups: dict[str, list[SmartBulb]] = {}
+send_delay_estimate: Union[float, None] = None
+exit_on_error: bool = __name__ == "__main__"
+daemon_task: Union[asyncio.Task, None] = None
+daemon_command: Union[list[str], None] = None
+daemon_error: Union[str, None] = None
+AUDIO_EXTENSIONS: tuple[str, ...] = (".mp3", ".wav", ".flac", ".ogg", ".oga", ".opus", ".m4a", ".aac")
+MUSIC_MODES: list[str] = ["cycle", "gradient"]
+ANALYSIS_BASE_KEYS: list[str] = ["sampling_rate", "hop_length", "bpm"]
+ANALYSIS_MODE_KEYS: dict[str, list[str]] = {"cycle": ["cycle_frames", "cycle_delta"], "gradient": ["rms"]}
+# Settings for librosa when analyzing music. The fast profile trades some cue time accuracy for speed, which matters
+# little since bulbs can only change color a few times a second. See benchmark_analysis.py for how they compare.
+ANALYSIS_PROFILES: dict[str, dict[str, Any]] = {
+    "default": {"sr": 22050, "res_type": "soxr_hq", "hop_length": 512},
+    "fast": {"sr": 11025, "res_type": "soxr_qq", "hop_length": 1024},
+}
+ANALYSIS_STORE_DIR = "music_analysis"
+# Frequency bands for the bands mode, as name:low-high in Hz. Leaving out the high frequency goes up to the highest
+# frequency in the song.
+DEFAULT_BANDS = "bass:20-250,mids:250-4000,highs:4000-"
+BAND_PEAK_WINDOW = 3  # A band's cue must be the loudest change within this many frames on either side
+BAND_PEAK_DELTA = 0.07  # How far above a band's average change a cue must be, relative to the band's largest change
+BULBLESS_MODES: list[str] = ["analyze"]
+SPIN_TIME = 0.005  # Sleep until this close to a light change, then busy-wait the rest for accuracy
+# Must match DAEMON_SOCKET_PATH in rgb_light_control_client.py
+DAEMON_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "rgb_light_control.sock")
+DAEMON_START_WAIT = 0.1  # Seconds to wait for a daemon command to fail on bad arguments before reporting it started
+BATCH_CANCEL_CHECK_INTERVAL = 0.25  # Seconds between checks for whether a batch analysis should stop
 
 
 class RGBLightControlException(Exception):
@@ -18,7 +53,7 @@ class RGBLightControlException(Exception):
 
 
 def error_exit(msg: str):
-    if __name__ == "__main__":
+    if exit_on_error:
         print(msg)
         sys.exit(1)
     else:
@@ -87,6 +122,21 @@ def ask_file_path(prompt: str, optional: bool = False) -> Union[str, None]:
     return path
 
 
+def ask_dir_path(prompt: str) -> str:
+    """Ask user for the path to a directory.
+
+    Args:
+        prompt: Question to ask.
+
+    Returns:
+        A path to a directory.
+    """
+    path = None
+    while path is None or not os.path.isdir(path):
+        path = os.path.expanduser(os.path.expandvars(input(prompt)))
+    return path
+
+
 def is_valid_rgb_colors_string(color_str: str) -> str:
     """Check if the provided color string is valid.
 
@@ -155,15 +205,70 @@ def convert_rgb_colors_string(colors: str) -> list[tuple[int, int, int]]:
     return out
 
 
+def resolve_path(path: str, cwd: Union[str, None] = None) -> str:
+    """Expand the user and environment variables in a path from the user.
+
+    Args:
+        path: The path.
+        cwd: Directory relative paths are relative to, or None for this process's working directory.
+
+    Returns:
+        The expanded path.
+    """
+    path = os.path.expanduser(os.path.expandvars(path))
+    return os.path.join(cwd, path) if cwd is not None else path
+
+
+def get_playlist_tracks(paths: list[str]) -> list[str]:
+    """Get the list of music files to play from a list of files and/or directories.
+
+    Args:
+        paths: Paths to music files or directories. Directories are searched recursively for music files, which are
+        played in alphabetical order.
+
+    Returns:
+        A list of paths to music files.
+    """
+    tracks = []
+    for path in paths:
+        path = os.path.expanduser(os.path.expandvars(path))
+        if os.path.isdir(path):
+            dir_tracks = []
+            for root, _, filenames in os.walk(path):
+                for filename in filenames:
+                    if filename.lower().endswith(AUDIO_EXTENSIONS):
+                        dir_tracks.append(os.path.join(root, filename))
+            tracks.extend(sorted(dir_tracks))
+        elif os.path.isfile(path):
+            tracks.append(path)
+        else:
+            error_exit(f"{path} is not a file or directory!")
+    return tracks
+
+
 async def load_bulbs():
-    """Loads all bulbs into this module's bulbs array from a list of IP addresses in lights.txt."""
+    """Loads all bulbs into this module's bulbs array from a list of IP addresses in lights.txt.
+
+    A line of the form [name] starts a group of bulbs, and every IP address after it, until the next group, is also
+    added to that group in this module's bulb_groups dictionary. An IP address can be listed in multiple groups.
+    """
     bulbs.clear()
+    bulb_groups.clear()
+    bulbs_by_ip = {}
+    group = None
     with open("lights.txt", "r") as f:
         lines = f.readlines()
     for line in lines:
         line = line.strip()
-        if line != "":
-            bulbs.append(SmartBulb(line))
+        if line.startswith("[") and line.endswith("]"):
+            group = line[1:-1].strip()
+            bulb_groups.setdefault(group, [])
+        elif line != "":
+            if line not in bulbs_by_ip:
+                bulbs_by_ip[line] = SmartBulb(line)
+                bulbs.append(bulbs_by_ip[line])
+            if group is not None:
+                bulb_groups[group].append(bulbs_by_ip[line])
     await asyncio.gather(*[bulb.update() for bulb in bulbs], return_exceptions=True)
 
 
@@ -193,6 +298,31 @@ async def estimate_send_delay(num_tests=40, bulbs_to_test=bulbs):
     return delay / 2  # Delay is cut in half to ignore the return-trip time.
 
 
+async def get_send_delay() -> float:
+    """Get the estimated send delay, only estimating it the first time it's needed.
+
+    Returns:
+        The estimate from estimate_send_delay().
+    """
+    global send_delay_estimate
+    if send_delay_estimate is None:
+        send_delay_estimate = await estimate_send_delay()
+    return send_delay_estimate
+
+
+async def wait_until(target: float):
+    """Wait until a time, sleeping for most of the wait and busy-waiting the end of it for accuracy.
+
+    Args:
+        target: The time to wait until, compared against time.time().
+    """
+    remaining = target - time.time()
+    if remaining > SPIN_TIME:
+        await asyncio.sleep(remaining - SPIN_TIME)
+    while time.time() < target:
+        pass
+
+
 async def send_hsv(h: int, s: int, v: int, transition: int = 0, bulbs_to_send: list[SmartBulb] = bulbs) -> tuple[Any]:
     """Set an HSV value to all bulbs, ignoring errors,
 
@@ -245,53 +375,135 @@ def average_color_weighted(hsv_min: tuple[int, int, int], hsv_max: tuple[int, in
             int(hsv_min[2] * z_weight + hsv_max[2] * weight))
 
 
-async def calculate_music_timings(mode: str, colors_in: list[tuple[int, int, int]], file: str,
-                                  send_delay: float) -> tuple[list[float], list[tuple[int, int, int]], int]:
-    """Calculate music timings from a given mode.
+def hash_music_file(file) -> str:
+    """Hash the contents of a music file, so its analysis can be stored and found again regardless of its name.
 
     Args:
-        mode: The mode to calculate for. Should either be 'cycle' or 'gradient'.
-        colors_in: The list of colors to use. Should be of exactly length 2 if using 'gradient', or at least length 1 for 'cycle'.
-        file: The path to the music file to calculate from or a file-like object.
-        send_delay: The delay between sending a light request and said request completing.
+        file: The path to the music file or a file-like object. File-like objects are rewound after hashing.
 
     Returns:
-        A tuple containing the list of times, the list of colors for those times, and the light transition time in that order.
-        All timings are in seconds, and the colors are a tuple in HSV format.
+        The SHA-256 hex digest of the file's contents.
 
     Raises:
-        ValueError: If the provided 'file' failed to load (likely due to it being invalid in some way).
+        ValueError: If the provided 'file' couldn't be read.
     """
-    if mode == "gradient" and len(colors_in) != 2:
-        error_exit("Can only use gradient music mode with exactly two colors.")
-    elif len(colors_in) < 1:
-        error_exit("Specify at least one color!")
+    digest = hashlib.sha256()
+    try:
+        if isinstance(file, str):
+            with open(file, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        else:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+            file.seek(0)
+    except OSError:
+        raise ValueError("Invalid audio file or filepath provided!")
+    return digest.hexdigest()
 
-    # Calculate beat timings
-    print("Calculating all light changes to make")
+
+def get_analysis_path(digest: str, profile: str = "default") -> str:
+    """Get the path a music file's analysis is stored at.
+
+    Args:
+        digest: The hash of the music file from hash_music_file().
+        profile: The analysis profile the music file was analyzed with.
+
+    Returns:
+        The path to the stored analysis. The file may not exist.
+    """
+    if profile == "default":
+        return os.path.join(ANALYSIS_STORE_DIR, f"{digest}.npz")
+    return os.path.join(ANALYSIS_STORE_DIR, f"{digest}-{profile}.npz")
+
+
+def load_stored_analysis(digest: str, modes: list[str], profile: str = "default") -> Union[dict[str, Any], None]:
+    """Load a previously stored analysis of a music file.
+
+    Args:
+        digest: The hash of the music file from hash_music_file().
+        modes: The music modes the analysis needs to be usable for.
+        profile: The analysis profile the music file needs to have been analyzed with.
+
+    Returns:
+        The analysis in the format analyze_music() returns, or None if there isn't a stored analysis usable for all the
+        provided modes.
+    """
+    path = get_analysis_path(digest, profile)
+    if not os.path.isfile(path):
+        return None
     try:
-        waveform, sampling_rate = librosa.load(file)
+        with np.load(path, allow_pickle=False) as data:
+            analysis = {key: data[key].item() if data[key].ndim == 0 else data[key] for key in data.files}
+    except (OSError, ValueError):
+        return None  # Corrupt or partially-written store entry, so just analyze again
+    for key in ANALYSIS_BASE_KEYS:
+        if key not in analysis:
+            return None
+    for mode in modes:
+        for key in ANALYSIS_MODE_KEYS[mode]:
+            if key not in analysis:
+                return None
+    return analysis
+
+
+def save_analysis(digest: str, analysis: dict[str, Any], profile: str = "default"):
+    """Store the analysis of a music file so it can be reused later.
+
+    Args:
+        digest: The hash of the music file from hash_music_file().
+        analysis: The analysis from analyze_music().
+        profile: The analysis profile the music file was analyzed with.
+    """
+    os.makedirs(ANALYSIS_STORE_DIR, exist_ok=True)
+    path = get_analysis_path(digest, profile)
+    # Write to a temporary file first so readers never see a partially-written analysis
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **analysis)
+    os.replace(tmp_path, path)
+
+
+def analyze_music(file, modes: list[str] = MUSIC_MODES, profile: str = "default") -> dict[str, Any]:
+    """Run the expensive part of calculating music timings, which doesn't depend on colors or the send delay.
+
+    Args:
+        file: The path to the music file to analyze or a file-like object.
+        modes: The music modes to analyze for.
+        profile: The analysis profile to use. Must be a key of ANALYSIS_PROFILES.
+
+    Returns:
+        A dictionary containing the keys in ANALYSIS_BASE_KEYS, along with the keys in ANALYSIS_MODE_KEYS for each of
+        the provided modes.
+
+    Raises:
+        ValueError: If the provided 'file' failed to load (likely due to it being invalid in some way).
+    """
+    settings = ANALYSIS_PROFILES[profile]
+    hop_length = settings["hop_length"]
+    try:
+        waveform, sampling_rate = librosa.load(file, sr=settings["sr"], mono=True, res_type=settings["res_type"])
     except Exception:
         raise ValueError("Invalid audio file or filepath provided!")
-    bpm = librosa.beat.beat_track(y=waveform, sr=sampling_rate)[0][0]
-    duration = librosa.get_duration(y=waveform, sr=sampling_rate)
-    max_notes = int(bpm / 60 * duration * 2 / 3)
-    if mode == "cycle":
+    tempo, beat_frames = librosa.beat.beat_track(y=waveform, sr=sampling_rate, hop_length=hop_length)
+    bpm = tempo[0]
+    analysis = {"sampling_rate": sampling_rate, "hop_length": hop_length, "bpm": bpm}
+    if "cycle" in modes:
+        duration = librosa.get_duration(y=waveform, sr=sampling_rate)
+        max_notes = int(bpm / 60 * duration * 2 / 3)
         # Get all notes that are significantly louder than the average of the song and the very close neighbors
         frames1 = []
         delta = 0.07
         while delta < 0.3:
             frames1 = librosa.onset.onset_detect(y=waveform, sr=sampling_rate, units="frames", backtrack=False,
-                                                 sparse=True,
+                                                 sparse=True, hop_length=hop_length,
                                                  pre_max=3, post_max=3, pre_avg=sampling_rate, post_avg=sampling_rate,
                                                  delta=delta)
             if len(frames1) < max_notes:
                 break
             delta += 0.01
         # Get notes on the automatically determined beat that aren't super close to the frames from above
-        bpm, frames2 = librosa.beat.beat_track(y=waveform, sr=sampling_rate)
-        bpm = bpm[0]
-        frames2 = list(frames2)
+        frames2 = list(beat_frames)
         to_remove = []
         for f in frames2:
             for g in range(-3, 4):
@@ -301,19 +513,41 @@ async def calculate_music_timings(mode: str, colors_in: list[tuple[int, int, int
         for f in to_remove:
             frames2.remove(f)
         # Merge the two lists of notes
-        frames = sorted(set(list(frames1) + list(frames2)))
-        print(f"Using delta {delta:.2f}. We have {len(frames)} light switches.")
-        times = list(librosa.frames_to_time(frames))
+        analysis["cycle_frames"] = np.array(sorted(set(list(frames1) + list(frames2))), dtype=np.int64)
+        analysis["cycle_delta"] = delta
+    if "gradient" in modes:
+        # Get the dB for the song (or something similar to it)
+        spectrogram = librosa.magphase(librosa.stft(waveform, hop_length=hop_length))[0]
+        analysis["rms"] = np.mean(librosa.feature.rms(S=spectrogram), axis=0)
+    return analysis
+
+
+def timings_from_analysis(mode: str, colors_in: list[tuple[int, int, int]], analysis: dict[str, Any],
+                          send_delay: float) -> tuple[list[float], list[tuple[int, int, int]], int]:
+    """Calculate music timings from a music analysis.
+
+    Args:
+        mode: The mode to calculate for. Should either be 'cycle' or 'gradient'.
+        colors_in: The list of colors to use. Should be of exactly length 2 if using 'gradient', or at least length 1 for 'cycle'.
+        analysis: The analysis from analyze_music(). Must have been analyzed for the provided mode.
+        send_delay: The delay between sending a light request and said request completing.
+
+    Returns:
+        The same tuple calculate_music_timings() returns.
+    """
+    sampling_rate = analysis["sampling_rate"]
+    hop_length = analysis["hop_length"]
+    bpm = analysis["bpm"]
+    if mode == "cycle":
+        frames = analysis["cycle_frames"]
+        print(f"Using delta {analysis['cycle_delta']:.2f}. We have {len(frames)} light switches.")
+        times = list(librosa.frames_to_time(frames, sr=sampling_rate, hop_length=hop_length))
         colors = []
         for g in range(len(times)):
             colors.append(colors_in[g % len(colors_in)])
         transition_time = bpm / 60 / 16  # Length of an estimated 64th note
     else:  # mode == "gradient"
-        # Get the dB for the song (or something similar to it)
-        dbs = librosa.feature.rms(S=librosa.magphase(librosa.stft(waveform))[0])
-        dbs = list(dbs.T)
-        for g in range(len(dbs)):
-            dbs[g] = np.mean(dbs[g])
+        dbs = [float(db) for db in analysis["rms"]]
         # Make sure all values are positive by scaling up by the absolute value of the minimum
         abs_min_db = abs(min(dbs))
         for g in range(len(dbs)):
@@ -323,8 +557,8 @@ async def calculate_music_timings(mode: str, colors_in: list[tuple[int, int, int
         frames_all = []
         colors_all = []
         dbs_all = []
-        frame_send_delay = max(librosa.time_to_frames([send_delay], sr=sampling_rate)[0], 1)
-        send_delay = librosa.frames_to_time([frame_send_delay], sr=sampling_rate)[0]
+        frame_send_delay = max(librosa.time_to_frames([send_delay], sr=sampling_rate, hop_length=hop_length)[0], 1)
+        send_delay = librosa.frames_to_time([frame_send_delay], sr=sampling_rate, hop_length=hop_length)[0]
         f = frame_send_delay
         while f < len(dbs):
             frames_all.append(f)
@@ -333,8 +567,9 @@ async def calculate_music_timings(mode: str, colors_in: list[tuple[int, int, int
             f += 1
 
         # Get the loudest frames per approximate eighth note, and only let that frame into the set of colors to show
-        colors_per_second = round(librosa.beat.beat_track(y=waveform, sr=sampling_rate)[0][0] * 2)
-        frames_per_group = int(librosa.time_to_frames([1 / colors_per_second], sr=sampling_rate)[0])
+        colors_per_second = round(bpm * 2)
+        frames_per_group = int(librosa.time_to_frames([1 / colors_per_second], sr=sampling_rate,
+                                                      hop_length=hop_length)[0])
         frames_per_group = max(frames_per_group, frame_send_delay)
         frames = []
         colors = []
@@ -378,8 +613,9 @@ async def calculate_music_timings(mode: str, colors_in: list[tuple[int, int, int
                 del dbs[index]
 
         # Calculate transition time and the times to do light changes
-        transition_time = int(librosa.frames_to_time([frames_per_group])[0] / 2)
-        times = librosa.frames_to_time(frames, sr=sampling_rate)
+        transition_time = int(librosa.frames_to_time([frames_per_group], sr=sampling_rate,
+                                                     hop_length=hop_length)[0] / 2)
+        times = librosa.frames_to_time(frames, sr=sampling_rate, hop_length=hop_length)
         print(f"We have {len(times)} total light switches.")
 
     # Apply estimated light change delay to all elements of the times list
@@ -398,7 +634,251 @@ async def calculate_music_timings(mode: str, colors_in: list[tuple[int, int, int
     return times, colors, transition_time
 
 
-async def cycle_music(mode: str, colors_in: list[tuple[int, int, int]], filepath: str, calc_filepath: Union[str, None]):
+def parse_bands(bands_str: str) -> list[tuple[str, float, float]]:
+    """Parse a string of frequency bands, such as DEFAULT_BANDS.
+
+    Args:
+        bands_str: Comma-separated bands in the form name:low-high, where low and high are in Hz. high can be left
+        out to include everything above low.
+
+    Returns:
+        A list of (name, low, high) tuples. high is infinity if it was left out.
+    """
+    bands = []
+    for band in bands_str.split(","):
+        name, _, freq_range = band.partition(":")
+        low, _, high = freq_range.partition("-")
+        try:
+            low = float(low)
+            high = float(high) if high != "" else float("inf")
+        except ValueError:
+            error_exit(f"{band} is not a band in the form name:low-high.")
+        if name == "" or low < 0 or high <= low:
+            error_exit(f"{band} is not a band in the form name:low-high.")
+        elif name in [b[0] for b in bands]:
+            error_exit(f"Band {name} is specified more than once.")
+        bands.append((name, low, high))
+    return bands
+
+
+def analyze_music_bands(file, bands: list[tuple[str, float, float]], profile: str = "default") -> dict[str, Any]:
+    """Find the cues for multiple frequency bands of a song from a single spectrogram.
+
+    Args:
+        file: The path to the music file to analyze or a file-like object.
+        bands: The bands to analyze, as returned by parse_bands().
+        profile: The analysis profile to use. Must be a key of ANALYSIS_PROFILES.
+
+    Returns:
+        A dictionary containing the keys in ANALYSIS_BASE_KEYS, along with 'band_frames', a dictionary of band names to
+        the frames of each band's cues.
+
+    Raises:
+        ValueError: If the provided 'file' failed to load (likely due to it being invalid in some way).
+    """
+    settings = ANALYSIS_PROFILES[profile]
+    hop_length = settings["hop_length"]
+    try:
+        waveform, sampling_rate = librosa.load(file, sr=settings["sr"], mono=True, res_type=settings["res_type"])
+    except Exception:
+        raise ValueError("Invalid audio file or filepath provided!")
+    spectrogram = np.abs(librosa.stft(waveform, hop_length=hop_length))
+    onset_envelope = librosa.onset.onset_strength(S=librosa.amplitude_to_db(spectrogram), sr=sampling_rate)
+    bpm = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sampling_rate, hop_length=hop_length)[0][0]
+
+    # Average the power in each band with one matrix multiply, giving a row of loudness per band
+    freqs = librosa.fft_frequencies(sr=sampling_rate, n_fft=2 * (spectrogram.shape[0] - 1))
+    weights = np.array([(freqs >= low) & (freqs < high) for _, low, high in bands], dtype=np.float64)
+    weights /= np.maximum(weights.sum(axis=1, keepdims=True), 1)
+    loudness = np.log1p(np.sqrt(weights @ spectrogram ** 2) * 100)
+
+    # Cues are where a band gets suddenly louder, and it's the largest jump among its neighbors
+    flux = np.maximum(np.diff(loudness, axis=1, prepend=loudness[:, :1]), 0)
+    flux /= np.maximum(flux.max(axis=1, keepdims=True), 1e-10)
+    padded = np.pad(flux, ((0, 0), (BAND_PEAK_WINDOW, BAND_PEAK_WINDOW)))
+    window_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * BAND_PEAK_WINDOW + 1, axis=1).max(axis=2)
+    peaks = (flux >= window_max) & (flux > flux.mean(axis=1, keepdims=True) + BAND_PEAK_DELTA)
+
+    band_frames = {name: np.flatnonzero(peaks[i]) for i, (name, _, _) in enumerate(bands)}
+    return {"sampling_rate": sampling_rate, "hop_length": hop_length, "bpm": bpm, "band_frames": band_frames}
+
+
+def band_timings_from_analysis(colors_in: list[tuple[int, int, int]], analysis: dict[str, Any], send_delay: float) \
+        -> tuple[dict[str, tuple[list[float], list[tuple[int, int, int]]]], float]:
+    """Calculate music timings for each band from a band analysis.
+
+    Args:
+        colors_in: The list of colors to cycle between. Each band starts at a different color.
+        analysis: The analysis from analyze_music_bands().
+        send_delay: The delay between sending a light request and said request completing.
+
+    Returns:
+        A tuple containing a dictionary of band names to a tuple of that band's times and colors, and the light
+        transition time. All timings are in seconds, and the colors are a tuple in HSV format.
+    """
+    transition_time = analysis["bpm"] / 60 / 16  # Length of an estimated 64th note
+    band_timings = {}
+    for band_index, (name, frames) in enumerate(analysis["band_frames"].items()):
+        times = []
+        colors = []
+        last_time = float("-inf")
+        for cue_time in librosa.frames_to_time(frames, sr=analysis["sampling_rate"], hop_length=analysis["hop_length"]):
+            # Skip cues that come faster than the bulbs can keep up with
+            if cue_time - last_time < send_delay + transition_time:
+                continue
+            last_time = cue_time
+            cue_time -= send_delay + transition_time
+            # Filter everything too early to send
+            if cue_time >= send_delay + transition_time:
+                times.append(float(cue_time))
+                colors.append(colors_in[(len(colors) + band_index) % len(colors_in)])
+        print(f"We have {len(times)} light switches for the {name} band.")
+        band_timings[name] = (times, colors)
+    return band_timings, transition_time
+
+
+async def calculate_music_band_timings(colors_in: list[tuple[int, int, int]], file, send_delay: float,
+                                       bands: list[tuple[str, float, float]], profile: str = "default") \
+        -> tuple[dict[str, tuple[list[float], list[tuple[int, int, int]]]], float]:
+    """Calculate music timings for multiple frequency bands, so each band can control a different group of bulbs.
+
+    Args:
+        colors_in: The list of colors to cycle between. Must be at least one element long.
+        file: The path to the music file to calculate from or a file-like object.
+        send_delay: The delay between sending a light request and said request completing.
+        bands: The bands to calculate for, as returned by parse_bands().
+        profile: The analysis profile to use. Should be a key of ANALYSIS_PROFILES, such as 'default' or 'fast'.
+
+    Returns:
+        The same tuple band_timings_from_analysis() returns.
+
+    Raises:
+        ValueError: If the provided 'file' failed to load (likely due to it being invalid in some way).
+    """
+    if len(colors_in) < 1:
+        error_exit("Specify at least one color!")
+    elif len(bands) < 1:
+        error_exit("Specify at least one band!")
+    elif profile not in ANALYSIS_PROFILES:
+        error_exit(f"Analysis profile must be one of {", ".join(ANALYSIS_PROFILES)}.")
+    print("Calculating all light changes to make")
+    # Analyze in a thread, so the event loop, such as the daemon's, can keep handling other things in the meantime
+    analysis = await asyncio.to_thread(analyze_music_bands, file, bands, profile)
+    return band_timings_from_analysis(colors_in, analysis, send_delay)
+
+
+async def calculate_music_timings(mode: str, colors_in: list[tuple[int, int, int]], file: str, send_delay: float,
+                                  profile: str = "default") -> tuple[list[float], list[tuple[int, int, int]], int]:
+    """Calculate music timings from a given mode.
+
+    If the music file has been analyzed before with the analyze mode, the stored analysis is used instead of analyzing
+    the file again.
+
+    Args:
+        mode: The mode to calculate for. Should either be 'cycle' or 'gradient'.
+        colors_in: The list of colors to use. Should be of exactly length 2 if using 'gradient', or at least length 1 for 'cycle'.
+        file: The path to the music file to calculate from or a file-like object.
+        send_delay: The delay between sending a light request and said request completing.
+        profile: The analysis profile to use. Should be a key of ANALYSIS_PROFILES, such as 'default' or 'fast'.
+
+    Returns:
+        A tuple containing the list of times, the list of colors for those times, and the light transition time in that order.
+        All timings are in seconds, and the colors are a tuple in HSV format.
+
+    Raises:
+        ValueError: If the provided 'file' failed to load (likely due to it being invalid in some way).
+    """
+    if mode == "gradient" and len(colors_in) != 2:
+        error_exit("Can only use gradient music mode with exactly two colors.")
+    elif len(colors_in) < 1:
+        error_exit("Specify at least one color!")
+    elif profile not in ANALYSIS_PROFILES:
+        error_exit(f"Analysis profile must be one of {", ".join(ANALYSIS_PROFILES)}.")
+
+    # Calculate beat timings
+    print("Calculating all light changes to make")
+    # Hash and analyze in a thread, so the event loop, such as the daemon's, can keep handling other things
+    digest = await asyncio.to_thread(hash_music_file, file)
+    analysis = load_stored_analysis(digest, [mode], profile)
+    if analysis is None:
+        analysis = await asyncio.to_thread(analyze_music, file, [mode], profile)
+    return timings_from_analysis(mode, colors_in, analysis, send_delay)
+
+
+def calculate_music_timings_sync(mode: str, colors_in: list[tuple[int, int, int]], file: str, send_delay: float,
+                                 profile: str = "default") -> tuple[list[float], list[tuple[int, int, int]], int]:
+    """Synchronous wrapper around calculate_music_timings() so it can be submitted to a worker process.
+
+    Args:
+        mode: See calculate_music_timings().
+        colors_in: See calculate_music_timings().
+        file: See calculate_music_timings().
+        send_delay: See calculate_music_timings().
+        profile: See calculate_music_timings().
+
+    Returns:
+        The same tuple calculate_music_timings() returns.
+    """
+    return asyncio.run(calculate_music_timings(mode, colors_in, file, send_delay, profile))
+
+
+async def play_music_timings(filepath: str, times: list[float], colors: list[tuple[int, int, int]],
+                             transition_time: float, targets: Union[list[list[SmartBulb]], None] = None):
+    """Play a music file, changing the lights at the provided times.
+
+    Args:
+        filepath: Filepath to music.
+        times: The times, in seconds from the start of the song, to change the lights at.
+        colors: The HSV colors to change the lights to at each time.
+        transition_time: The light transition time in seconds.
+        targets: The bulbs to change at each time. If None, all bulbs are changed every time. Otherwise, each light
+        change is sent without waiting for the previous one to finish, so changes for different bulbs close together
+        aren't delayed by each other.
+
+    Returns:
+        Returns None once the song is done playing.
+    """
+    # Pygame init
+    pygame.init()
+    music.load(filepath)
+
+    transition_time = int(transition_time * 1000)  # Convert to int in ms for passing to bulbs
+
+    index = 0
+    sends = set()  # Keep references to light changes in progress, as the event loop only keeps weak ones
+    music.play()
+    start = time.time()
+
+    try:
+        # Wait until the instant we're supposed to send each light change. This way, we don't need to time the rest
+        # of the code. The wait mostly sleeps, so other tasks, such as daemon commands, can still run.
+        while True:
+            # Get next time to play at and the color to play at that time.
+            next_time = times[index]
+            hsv = colors[index]
+            await wait_until(start + next_time)
+            # Send HSV and advances index.
+            if targets is None:
+                await send_hsv(hsv[0], hsv[1], hsv[2], transition=transition_time)
+            else:
+                send = asyncio.create_task(send_hsv(hsv[0], hsv[1], hsv[2], transition=transition_time,
+                                                    bulbs_to_send=targets[index]))
+                sends.add(send)
+                send.add_done_callback(sends.discard)
+            index += 1
+            # Wait until end of song once we're through with all the lights, then return
+            if index >= len(times):
+                while music.get_busy():
+                    await asyncio.sleep(0.05)
+                return
+    finally:
+        music.stop()  # Only does anything if playback was stopped early
+        for send in sends:
+            send.cancel()
+
+
+async def cycle_music(mode: str, colors_in: list[tuple[int, int, int]], filepath: str, calc_filepath: Union[str, None],
+                      profile: str = "default"):
     """Change lights to the notes of the song.
 
     Args:
@@ -407,53 +887,406 @@ async def cycle_music(mode: str, colors_in: list[tuple[int, int, int]], filepath
         filepath: Filepath to music
         calc_filepath: Filepath to file to use for beats/peaks calculations. Helpful to pass an instrumental here. If
                        None, the path supplied as filepath is used.
+        profile: The analysis profile to use. Must be a key of ANALYSIS_PROFILES.
 
     Returns:
         Returns None once the song is done playing, or exits on an error.
     """
-    send_delay = await estimate_send_delay()
+    send_delay = await get_send_delay()
     calc_filepath = calc_filepath if calc_filepath is not None else filepath
-    times, colors, transition_time = await calculate_music_timings(mode, colors_in, calc_filepath, send_delay)
+    times, colors, transition_time = await calculate_music_timings(mode, colors_in, calc_filepath, send_delay,
+                                                                   profile)
+    await play_music_timings(filepath, times, colors, transition_time)
 
-    # Pygame init
-    pygame.init()
-    music.load(filepath)
 
-    transition_time = int(transition_time * 1000)  # Convert to int in ms for passing to bulbs
+async def cycle_music_bands(colors_in: list[tuple[int, int, int]], filepath: str, calc_filepath: Union[str, None],
+                            bands: list[tuple[str, float, float]], profile: str = "default"):
+    """Change each group of bulbs in lights.txt to the notes of the frequency band with the same name.
 
-    index = 0
-    music.play()
+    Args:
+        colors_in: Colors to cycle between as a list of HSV tuples. Must be at least one element long.
+        filepath: Filepath to music
+        calc_filepath: Filepath to file to use for calculations. If None, the path supplied as filepath is used.
+        bands: The bands to use, as returned by parse_bands().
+        profile: The analysis profile to use. Must be a key of ANALYSIS_PROFILES.
+
+    Returns:
+        Returns None once the song is done playing, or exits on an error.
+    """
+    missing = [name for name, _, _ in bands if name not in bulb_groups]
+    if len(missing) == len(bands):
+        error_exit(f"lights.txt has no groups for any band! Add a line with [name] above the bulbs for a band, "
+                   f"where name is one of {", ".join(name for name, _, _ in bands)}.")
+    for name in missing:
+        print(f"lights.txt has no [{name}] group, so the {name} band will be skipped.")
+
+    send_delay = await get_send_delay()
+    calc_filepath = calc_filepath if calc_filepath is not None else filepath
+    band_timings, transition_time = await calculate_music_band_timings(colors_in, calc_filepath, send_delay, bands,
+                                                                       profile)
+    # Merge every band into one timeline, keeping track of which group each light change is for
+    changes = sorted((cue_time, color, name) for name, (times, colors) in band_timings.items()
+                     if name not in missing for cue_time, color in zip(times, colors))
+    times = [change[0] for change in changes]
+    colors = [change[1] for change in changes]
+    targets = [bulb_groups[change[2]] for change in changes]
+    await play_music_timings(filepath, times, colors, transition_time, targets)
+
+
+async def cycle_playlist(mode: str, colors_in: list[tuple[int, int, int]], filepaths: list[str],
+                         prefetch_depth: int = 2, workers: int = 1, profile: str = "default"):
+    """Change lights to the notes of each song in a playlist, analyzing upcoming songs while the current one plays.
+
+    Args:
+        mode: A mode. Can always be 'cycle', but can only be 'gradient' if colors_in is of length 2.
+        colors_in: Colors to cycle between as a list of HSV tuples. Must be at least one element long.
+        filepaths: Filepaths to the music to play, in order.
+        prefetch_depth: How many songs past the one currently playing to analyze ahead of time. Must be at least 1.
+        workers: Number of worker processes to analyze songs with. Must be at least 1.
+        profile: The analysis profile to use. Must be a key of ANALYSIS_PROFILES.
+
+    Returns:
+        Returns None once the last song is done playing, or exits on an error.
+    """
+    if mode == "gradient" and len(colors_in) != 2:
+        error_exit("Can only use gradient music mode with exactly two colors.")
+    elif len(colors_in) < 1:
+        error_exit("Specify at least one color!")
+    elif len(filepaths) == 0:
+        error_exit("The playlist does not contain any music!")
+    elif prefetch_depth < 1:
+        error_exit("Must prefetch at least one song.")
+    elif workers < 1:
+        error_exit("Must use at least one worker.")
+    elif profile not in ANALYSIS_PROFILES:
+        error_exit(f"Analysis profile must be one of {", ".join(ANALYSIS_PROFILES)}.")
+
+    send_delay = await get_send_delay()
+
+    def new_executor() -> ProcessPoolExecutor:
+        # Spawn rather than fork, as forking after pygame starts its audio thread is unsafe
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(track_index: int) -> Future:
+        return executor.submit(calculate_music_timings_sync, mode, colors_in, filepaths[track_index], send_delay,
+                               profile)
+
+    def restart_executor() -> ProcessPoolExecutor:
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Keep songs that were analyzed before the pool broke. The rest are submitted again when they're next needed.
+        for track_index, future in list(pending.items()):
+            if future.cancelled() or not future.done() or isinstance(future.exception(), BrokenProcessPool):
+                del pending[track_index]
+        return new_executor()
+
+    executor = new_executor()
+    pending = {}
+    try:
+        for index, filepath in enumerate(filepaths):
+            pool_breaks = 0
+            timings = None
+            try:
+                while timings is None:
+                    # Keep the current song and up to prefetch_depth songs after it submitted for analysis. When a
+                    # worker dies, every song being analyzed fails, even if another song caused it, so the current song
+                    # is then analyzed again on its own.
+                    last_index = min(index + (prefetch_depth if pool_breaks == 0 else 0), len(filepaths) - 1)
+                    try:
+                        for track_index in range(index, last_index + 1):
+                            if track_index not in pending:
+                                pending[track_index] = submit(track_index)
+                    except BrokenProcessPool:
+                        # A worker died since the last song started, which says nothing about the current song
+                        executor = restart_executor()
+                        continue
+                    try:
+                        timings = await asyncio.wrap_future(pending.pop(index))
+                    except BrokenProcessPool:
+                        pool_breaks += 1
+                        executor = restart_executor()
+                        if pool_breaks >= 2:
+                            raise
+            except ValueError:
+                print(f"Skipping {filepath}, as it is not a valid audio file.")
+                continue
+            except BrokenProcessPool:
+                print(f"Skipping {filepath}, as analyzing it stopped a worker process unexpectedly.")
+                continue
+            except Exception as e:  # Skip the song on any other failure too, rather than ending the whole playlist
+                print(f"Skipping {filepath}, as it failed to be analyzed: {e}")
+                continue
+            times, colors, transition_time = timings
+            print(f"Now playing {filepath} ({index + 1}/{len(filepaths)})")
+            await play_music_timings(filepath, times, colors, transition_time)
+    finally:
+        # Don't wait on songs still being analyzed, so stopping playback early is instant
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def analyze_and_store(filepath: str, digest: str, profile: str = "default"):
+    """Analyze a music file for all music modes and store the analysis. Meant to be run in a worker process.
+
+    Args:
+        filepath: Filepath to music.
+        digest: The hash of the music file from hash_music_file().
+        profile: The analysis profile to use. Must be a key of ANALYSIS_PROFILES.
+
+    Raises:
+        ValueError: If the provided file failed to load.
+    """
+    save_analysis(digest, analyze_music(filepath, MUSIC_MODES, profile), profile)
+
+
+def batch_analyze(library: str, workers: int, profile: str = "default",
+                  cancel_event: Union[threading.Event, None] = None) -> tuple[int, list[tuple[str, str]]]:
+    """Analyze every music file in a directory that hasn't been analyzed yet, storing the results for later use.
+
+    Args:
+        library: Path to a directory of music files. Searched recursively.
+        workers: Number of worker processes to analyze songs with. Must be at least 1.
+        profile: The analysis profile to use. Must be a key of ANALYSIS_PROFILES.
+        cancel_event: If provided, setting it stops the batch early. Files that haven't started being analyzed are
+        skipped, and this returns once the files being analyzed are done.
+
+    Returns:
+        A tuple containing the number of files analyzed and a list of (filepath, error message) tuples for every file
+        that failed to be analyzed.
+    """
+    if not os.path.isdir(library):
+        error_exit(f"{library} is not a directory!")
+    elif workers < 1:
+        error_exit("Must use at least one worker.")
+    elif profile not in ANALYSIS_PROFILES:
+        error_exit(f"Analysis profile must be one of {", ".join(ANALYSIS_PROFILES)}.")
+    filepaths = get_playlist_tracks([library])
+    to_analyze = {}
+    failures = []
+    skipped = 0
+    for filepath in filepaths:
+        try:
+            digest = hash_music_file(filepath)
+        except ValueError as e:
+            failures.append((filepath, str(e)))
+            continue
+        if digest in to_analyze or load_stored_analysis(digest, MUSIC_MODES, profile) is not None:
+            skipped += 1
+        else:
+            to_analyze[digest] = filepath
+    print(f"Found {len(filepaths)} music files. Skipping {skipped} that are already analyzed or duplicates.")
+
+    analyzed = 0
+    done = 0
     start = time.time()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(analyze_and_store, filepath, digest, profile): filepath
+                   for digest, filepath in to_analyze.items()}
+        not_done = set(futures)
+        while len(not_done) > 0:
+            if cancel_event is not None and cancel_event.is_set():
+                print("Stopping early. Waiting for the files being analyzed to finish.")
+                executor.shutdown(wait=True, cancel_futures=True)
+                not_done = {future for future in not_done if not future.cancelled()}  # All done now
+            finished, not_done = wait(not_done, timeout=BATCH_CANCEL_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done += 1
+                filepath = futures[future]
+                try:
+                    future.result()
+                    analyzed += 1
+                    print(f"[{done}/{len(futures)}] Analyzed {filepath}")
+                except Exception as e:  # Report any failure and keep going, since a batch can take hours
+                    failures.append((filepath, str(e)))
+                    print(f"[{done}/{len(futures)}] Failed to analyze {filepath}: {e}")
+    elapsed = time.time() - start
+
+    files_per_minute = analyzed / elapsed * 60 if elapsed > 0 else 0
+    print(f"Analyzed {analyzed} files in {elapsed:.1f} seconds ({files_per_minute:.1f} files/minute) with "
+          f"{workers} workers. {len(failures)} files failed.")
+    for filepath, err in failures:
+        print(f"  {filepath}: {err}")
+    return analyzed, failures
+
+
+def pop_option(args: list[str], name: str, default: str) -> str:
+    """Remove an option in the form --name=value from a list of arguments and return its value.
 
-    # Use a tight loop to send a light change request the instant we're supposed to. This way, we don't need
-    # to time the rest of the code.
-    while True:
-        # Get next time to play at and the color to play at that time.
-        next_time = times[index]
-        hsv = colors[index]
-        # Tight loop until ready to do light change
-        while time.time() - start < next_time:
+    Args:
+        args: Arguments to search. The option is removed from this list if found.
+        name: Name of the option, not including the leading dashes.
+        default: Value to return if the option isn't provided.
+
+    Returns:
+        The value of the option, or the default if it wasn't provided.
+    """
+    prefix = f"--{name}="
+    for arg in args:
+        if arg.startswith(prefix):
+            args.remove(arg)
+            return arg[len(prefix):]
+    return default
+
+
+def pop_int_option(args: list[str], name: str, default: int) -> int:
+    """Same as pop_option(), but for an option that must be an int.
+
+    Args:
+        args: Arguments to search. The option is removed from this list if found.
+        name: Name of the option, not including the leading dashes.
+        default: Value to return if the option isn't provided.
+
+    Returns:
+        The value of the option, or the default if it wasn't provided.
+    """
+    value = pop_option(args, name, str(default))
+    try:
+        return int(value)
+    except ValueError:
+        error_exit(f"{value} is not a number!")
+
+
+def warm_up_librosa():
+    """Run librosa's analysis functions on a short, generated song, so its one-time setup is done ahead of time."""
+    sampling_rate = ANALYSIS_PROFILES["default"]["sr"]
+    waveform = np.random.default_rng(0).uniform(-1, 1, sampling_rate * 2).astype(np.float32)
+    librosa.beat.beat_track(y=waveform, sr=sampling_rate)
+    librosa.onset.onset_detect(y=waveform, sr=sampling_rate)
+    librosa.feature.rms(S=librosa.magphase(librosa.stft(waveform))[0])
+
+
+def on_daemon_task_done(task: asyncio.Task):
+    """Record why a daemon command stopped, if it was because of an error."""
+    global daemon_error
+    if not task.cancelled() and task.exception() is not None:
+        daemon_error = str(task.exception())
+        print(f"{" ".join(daemon_command)} stopped with an error: {daemon_error}")
+
+
+async def stop_daemon_task():
+    """Stop the command the daemon is running, if any."""
+    global daemon_task, daemon_command
+    if daemon_task is not None and not daemon_task.done():
+        daemon_task.cancel()
+        try:
+            await daemon_task
+        except (asyncio.CancelledError, Exception):
+            pass
+    daemon_task = None
+    daemon_command = None
+
+
+async def handle_daemon_command(args: list[str], cwd: Union[str, None] = None) -> tuple[bool, str]:
+    """Run a command sent to the daemon.
+
+    Args:
+        args: The command and its arguments. Can be any arguments accepted by run_with_args(), which replace whatever
+        the daemon was running, or one of 'stop', 'status', or 'reload'.
+        cwd: The working directory of the client that sent the command, which relative paths are relative to.
+
+    Returns:
+        A tuple containing whether the command succeeded and a message about it.
+    """
+    global daemon_task, daemon_command, daemon_error, send_delay_estimate
+    if len(args) == 0:
+        return False, "No command given."
+    elif args[0] == "stop":
+        await stop_daemon_task()
+        return True, "Stopped."
+    elif args[0] == "status":
+        if daemon_task is not None and not daemon_task.done():
+            return True, f"Running {" ".join(daemon_command)}. Send delay is {send_delay_estimate:.3f} seconds."
+        elif daemon_error is not None:
+            return True, f"Idle. The last command stopped with an error: {daemon_error}"
+        return True, "Idle."
+    elif args[0] == "reload":
+        await stop_daemon_task()
+        await verify_and_init()
+        send_delay_estimate = None
+        await get_send_delay()
+        return True, f"Reloaded {len(bulbs)} bulbs. Send delay is {send_delay_estimate:.3f} seconds."
+    elif args[0] == "daemon":
+        return False, "The daemon is already running."
+
+    await stop_daemon_task()
+    daemon_command = args
+    daemon_error = None
+    daemon_task = asyncio.create_task(run_with_args(args, cwd))
+    daemon_task.add_done_callback(on_daemon_task_done)
+    # Argument errors happen right away, so give the command a moment to fail before saying it started
+    await asyncio.wait([daemon_task], timeout=DAEMON_START_WAIT)
+    if daemon_task.done() and not daemon_task.cancelled() and daemon_task.exception() is not None:
+        return False, str(daemon_task.exception())
+    return True, f"Started {" ".join(args)}."
+
+
+async def run_daemon(socket_path: str):
+    """Keep bulbs, libraries, and the send delay estimate loaded, running commands sent over a Unix domain socket.
+
+    Each connection sends one line of JSON in the form {"args": [...], "cwd": "..."}, where cwd is optional, and gets
+    back one line of JSON in the form {"ok": true, "message": "..."}. See rgb_light_control_client.py.
+
+    Args:
+        socket_path: Path to create the socket at.
+
+    Returns:
+        This function does not return.
+    """
+    global exit_on_error
+
+    async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                command = json.loads(await reader.readline())
+                cwd = command.get("cwd")
+                if cwd is not None and not isinstance(cwd, str):
+                    raise TypeError("cwd must be a string.")
+                ok, message = await handle_daemon_command([str(arg) for arg in command["args"]], cwd)
+            except RGBLightControlException as e:  # Such as reload when lights.txt is gone
+                ok, message = False, str(e)
+            except (ValueError, KeyError, TypeError):
+                ok, message = False, "Invalid request."
+            writer.write(json.dumps({"ok": ok, "message": message}).encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
             pass
-        # Send HSV and advances index.
-        await send_hsv(hsv[0], hsv[1], hsv[2], transition=transition_time)
-        index += 1
-        # Tight loop to wait until end of song once we're through with all the lights, then return
-        if index >= len(times):
-            while music.get_busy():
-                pass
-            return
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        try:
+            _, writer = await asyncio.open_unix_connection(socket_path)
+            writer.close()
+        except OSError:
+            os.remove(socket_path)  # Left behind by a daemon that didn't shut down cleanly
+        else:
+            error_exit(f"A daemon is already running at {socket_path}!")
+    exit_on_error = False  # Bad commands shouldn't take the daemon down with them
+    print("Loading music analysis libraries")
+    await asyncio.to_thread(warm_up_librosa)
+    await get_send_delay()
+    server = await asyncio.start_unix_server(handle_client, path=socket_path)
+    print(f"Listening for commands at {socket_path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await stop_daemon_task()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
 
 
-async def run_with_args(args: list[str]):
+async def run_with_args(args: list[str], cwd: Union[str, None] = None):
     """Run this script with the provided list of arguments.
 
     Args:
         args: Arguments to run this script with, not including the script name.
+        cwd: Directory relative paths in the arguments are relative to, or None for this process's working directory.
 
     Returns:
         This function does not return. This function either exits the program with an error code or runs until
         interrupted.
     """
+    args = list(args)
+    profile = pop_option(args, "profile", "default")
     mode = args[0]
     if mode == "rainbow":
         speed = 5
@@ -466,19 +1299,66 @@ async def run_with_args(args: list[str]):
     elif mode == "music":
         if len(args) < 4:
             error_exit("Please specify a mode (cycle or gradient), an RGB color string, a filepath to the music, "
-                       "and optionally, a filepath to the music for calculations, such as an instrumental.")
+                       "and optionally, a filepath to the music for calculations, such as an instrumental, and "
+                       "--profile=fast to analyze the music faster but less accurately.")
         music_mode = args[1]
         colors = convert_rgb_colors_string(args[2])
-        filepath = os.path.expanduser(os.path.expandvars(args[3]))
+        filepath = resolve_path(args[3], cwd)
         if not os.path.isfile(filepath):
             error_exit(f"{filepath} is not a file!")
         calc_filepath = args[4] if len(args) >= 5 else None
         if calc_filepath is not None:
-            calc_filepath = os.path.expanduser(os.path.expandvars(args[4]))
+            calc_filepath = resolve_path(args[4], cwd)
             if not os.path.isfile(calc_filepath):
                 error_exit(f"{calc_filepath} is not a file!")
-        await cycle_music(music_mode, colors, filepath, calc_filepath)
-
+        await cycle_music(music_mode, colors, filepath, calc_filepath, profile)
+    elif mode == "playlist":
+        prefetch_depth = pop_int_option(args, "prefetch", 2)
+        workers = pop_int_option(args, "workers", 1)
+        if len(args) < 4:
+            error_exit("Please specify a mode (cycle or gradient), an RGB color string, one or more music files or "
+                       "directories of music, and optionally, --prefetch=N to analyze N songs ahead and --workers=N "
+                       "to analyze with N processes, and --profile=fast to analyze the music faster but less "
+                       "accurately.")
+        music_mode = args[1]
+        colors = convert_rgb_colors_string(args[2])
+        filepaths = get_playlist_tracks([resolve_path(path, cwd) for path in args[3:]])
+        await cycle_playlist(music_mode, colors, filepaths, prefetch_depth, workers, profile)
+    elif mode == "bands":
+        bands = parse_bands(pop_option(args, "bands", DEFAULT_BANDS))
+        if len(args) < 3:
+            error_exit("Please specify an RGB color string, a filepath to the music, and optionally, a filepath to the "
+                       "music for calculations, such as an instrumental, --bands=name:low-high,... to choose the "
+                       f"frequency bands (defaults to {DEFAULT_BANDS}), and --profile=fast to analyze the music faster "
+                       "but less accurately.")
+        colors = convert_rgb_colors_string(args[1])
+        filepath = resolve_path(args[2], cwd)
+        if not os.path.isfile(filepath):
+            error_exit(f"{filepath} is not a file!")
+        calc_filepath = args[3] if len(args) >= 4 else None
+        if calc_filepath is not None:
+            calc_filepath = resolve_path(args[3], cwd)
+            if not os.path.isfile(calc_filepath):
+                error_exit(f"{calc_filepath} is not a file!")
+        await cycle_music_bands(colors, filepath, calc_filepath, bands, profile)
+    elif mode == "daemon":
+        await run_daemon(pop_option(args, "socket", DAEMON_SOCKET_PATH))
+    elif mode == "analyze":
+        workers = pop_int_option(args, "workers", os.cpu_count() or 1)
+        if len(args) < 2:
+            error_exit("Please specify a directory of music to analyze, and optionally, --workers=N to analyze with N "
+                       "processes and --profile=fast to analyze the music faster but less accurately.")
+        cancel_event = threading.Event()
+        batch = asyncio.ensure_future(asyncio.to_thread(batch_analyze, resolve_path(args[1], cwd), workers, profile,
+                                                        cancel_event))
+        try:
+            await asyncio.shield(batch)
+        except asyncio.CancelledError:
+            # The thread can't be cancelled, so tell it to stop instead. Wait for it, so another batch started right
+            # after, such as by the daemon, never writes to the analysis store at the same time as this one.
+            cancel_event.set()
+            await batch
+            raise
     else:
         error_exit(f"Invalid mode {mode}.")
 
@@ -493,10 +1373,11 @@ async def verify_and_init():
 
 async def main():
     """Main entrypoint"""
-    await verify_and_init()
+    if len(sys.argv) == 1 or sys.argv[1] not in BULBLESS_MODES:
+        await verify_and_init()
     if len(sys.argv) == 1:
         args = []
-        mode = ask("Which mode do you want to use?", ["rainbow", "music"], "rainbow")
+        mode = ask("Which mode do you want to use?", ["rainbow", "music", "playlist"], "rainbow")
         args.append(mode)
         if mode == "rainbow":
             speed = ask_int("Input a speed, where 360 goes through the entire rainbow", 5)
@@ -509,6 +1390,11 @@ async def main():
             args.append(ask_file_path("Enter the file path to the instrumental if you have one: ", optional=True))
             if args[1] == "bpm":
                 args.append(str(ask_int("Enter a BPM, or don't specify one to try to determine it automatically.", 0)))
+        elif mode == "playlist":
+            args.append(ask("Which submode of music sync do you want to use?",
+                            ["cycle", "gradient"], "cycle"))
+            args.append(ask_colors_rgb("Enter a list of RGB values to change between each beat: "))
+            args.append(ask_dir_path("Enter the path to a directory of music to play: "))
         await run_with_args(args)
     else:
         await run_with_args(sys.argv[1:])
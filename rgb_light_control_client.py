@@ -0,0 +1,64 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+
+# Must match DAEMON_SOCKET_PATH in rgb_light_control.py. Only the standard library is imported here, so sending a
+# command doesn't pay for loading librosa or pygame.
+DAEMON_SOCKET_PATH = os.path.join(tempfile.gettempdir(), "rgb_light_control.sock")
+
+
+def send_command(args: list[str], socket_path: str = DAEMON_SOCKET_PATH) -> tuple[bool, str]:
+    """Send a command to a running rgb_light_control.py daemon.
+
+    Args:
+        args: The command and its arguments, such as ['rainbow', '5'] or ['stop'].
+        socket_path: Path to the daemon's socket.
+
+    Returns:
+        A tuple containing whether the command succeeded and the daemon's message about it.
+
+    Raises:
+        ConnectionError: If the daemon closed the connection without replying.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        # The daemon may be running from a different directory, so send this one for it to resolve relative paths with
+        sock.sendall(json.dumps({"args": args, "cwd": os.getcwd()}).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if line == b"":
+        raise ConnectionError("The daemon closed the connection without replying. Check its output for errors.")
+    response = json.loads(line)
+    return response["ok"], response["message"]
+
+
+def main():
+    """Main entrypoint"""
+    args = sys.argv[1:]
+    socket_path = DAEMON_SOCKET_PATH
+    for arg in args:
+        if arg.startswith("--socket="):
+            socket_path = arg[len("--socket="):]
+            args.remove(arg)
+            break
+    if len(args) == 0:
+        print("Please specify a command, such as rainbow, music, playlist, bands, stop, status, or reload, followed by "
+              "its arguments.")
+        sys.exit(1)
+    try:
+        ok, message = send_command(args, socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"No daemon is running at {socket_path}! Start one with python rgb_light_control.py daemon.")
+        sys.exit(1)
+    except ConnectionError as e:
+        print(e)
+        sys.exit(1)
+    print(message)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
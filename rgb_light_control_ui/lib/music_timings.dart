@@ -0,0 +1,38 @@
+import 'dart:typed_data';
+
+class MusicTimings {
+  static const String mimeType = "application/vnd.rgb-light-control.timings";
+  static const int _version = 1;
+  static const int _headerLength = 16;
+
+  final Float32List times;
+  final Uint16List colors;  // Flattened HSV triples, three per time
+  final double transitionTime;
+
+  const MusicTimings({required this.times, required this.colors, required this.transitionTime});
+
+  int get length => times.length;
+
+  factory MusicTimings.fromBytes(Uint8List bytes) {
+    final data = ByteData.sublistView(bytes);
+    if (bytes.length < _headerLength || String.fromCharCodes(bytes, 0, 4) != "RGBT") {
+      throw const FormatException("Invalid format received.");
+    }
+    final version = data.getUint32(4, Endian.little);
+    final count = data.getUint32(8, Endian.little);
+    if (version != _version || bytes.length != _headerLength + count * 4 + count * 6) {
+      throw const FormatException("Invalid format received.");
+    }
+    final transitionTime = data.getFloat32(12, Endian.little);
+    final times = Float32List(count);
+    for (int i = 0; i < count; i++) {
+      times[i] = data.getFloat32(_headerLength + i * 4, Endian.little);
+    }
+    final colorsOffset = _headerLength + count * 4;
+    final colors = Uint16List(count * 3);
+    for (int i = 0; i < count * 3; i++) {
+      colors[i] = data.getUint16(colorsOffset + i * 2, Endian.little);
+    }
+    return MusicTimings(times: times, colors: colors, transitionTime: transitionTime);
+  }
+}
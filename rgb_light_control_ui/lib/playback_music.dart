@@ -4,6 +4,7 @@ import 'package:file_selector/file_selector.dart';
 import 'package:flutter/material.dart';
 import 'package:http/http.dart' as http;
 import 'package:just_audio/just_audio.dart';
+import 'package:rgb_light_control_ui/music_timings.dart';
 import 'package:rgb_light_control_ui/settings.dart';
 import 'package:rgb_light_control_ui/xfile_audio_source.dart';
 
@@ -34,14 +35,14 @@ class MusicPlayback extends StatefulWidget {
 
 class MusicPlaybackState extends State<MusicPlayback> {
 
-  late Future<Map?> lightDataFuture;
+  late Future<MusicTimings> lightDataFuture;
   late Future<AudioPlayer> musicPlayer;
   late Future<void> musicPlaying;
   int hValue = 0;
   bool canceled = false;
   Color playbackColor = Colors.black;
 
-  Future<Map> getLightData() async {
+  Future<MusicTimings> getLightData() async {
     // Get instrumental to send
     XFile? instrumental = widget.settings.instrumentalFile ?? widget.settings.musicFile;
     if (instrumental == null) {
@@ -74,10 +75,13 @@ class MusicPlaybackState extends State<MusicPlayback> {
         colorList.add([color.hue.round(), (color.saturation * 100).round(), (color.value * 100).round()]);
       }
       final musicCalcResp = await http.post(Uri.parse("${Constants.apiRoot}/calculate_music_timings"),
-          headers: {"Content-Type": "application/json"},
+          headers: {"Content-Type": "application/json", "Accept": MusicTimings.mimeType},
           body: jsonEncode({"mode": widget.getModeFromName(), "send_delay": sendDelay, "colors": colorList,
             "file": {"filename": "file", "data": const Base64Encoder().convert(await instrumental.readAsBytes())}}));
-      return jsonDecode(musicCalcResp.body)["data"];
+      if (musicCalcResp.statusCode != 200) {
+        throw Exception("Failed to calculate music timings ${musicCalcResp.body}");
+      }
+      return MusicTimings.fromBytes(musicCalcResp.bodyBytes);
     } else {
       throw Exception("Failed to get light send delay ${lightDelayResp.body}");
     }
@@ -94,46 +98,43 @@ class MusicPlaybackState extends State<MusicPlayback> {
   }
 
   Future<void> playMusic() async {
-    Map? lightData = await lightDataFuture;
+    MusicTimings lightData = await lightDataFuture;
     AudioPlayer player = await musicPlayer;
-    if (lightData != null) {
-      List<double> timesMS = List<double>.from(lightData["times"] as List);
-      for (int i = 0; i < timesMS.length; i++) {
-        timesMS[i] *= 1000;
-      }
-      List<List> colorsJSONArray = List<List>.from(lightData["colors"] as List);
-      List<String> colorsJSONMaps = [];
-      List<Color> colorsColors = [];
-      for (final color in colorsJSONArray) {
-        colorsColors.add(HSVColor.fromAHSV(1, color[0].round(), (color[1] / 100).round(), (color[2] / 100).round()).toColor());
-        colorsJSONMaps.add(jsonEncode({"h": color[0], "s": color[1], "v": color[2], "lights": widget.lightNames}));
-      }
-      int index = 0;
-      Future<void> playback = player.play();
-      while (index < timesMS.length && !canceled) {
-        final nextTime = timesMS[index];
-        final nextColorJSON = colorsJSONMaps[index];
-        final nextColorColor = colorsColors[index];
-        double waitTime = nextTime - player.position.inMilliseconds;
-        await Future.delayed(Duration(milliseconds: waitTime.floor()));
-        try {
-          await http.post(Uri.parse("${Constants.apiRoot}/set_hsv"),
-              headers: {"Content-Type": "application/json"},
-              body: nextColorJSON
-          );
-        } catch (ignored) {
-          // No-op
-        }
-        setState(() {
-          playbackColor = nextColorColor;
-        });
-        index += 1;
-      }
-      if (canceled) {
-        player.stop();
-      } else {
-        await playback;
+    List<double> timesMS = List<double>.generate(lightData.length, (i) => lightData.times[i] * 1000);
+    List<String> colorsJSONMaps = [];
+    List<Color> colorsColors = [];
+    for (int i = 0; i < lightData.length; i++) {
+      final h = lightData.colors[i * 3];
+      final s = lightData.colors[i * 3 + 1];
+      final v = lightData.colors[i * 3 + 2];
+      colorsColors.add(HSVColor.fromAHSV(1, h.toDouble(), s / 100, v / 100).toColor());
+      colorsJSONMaps.add(jsonEncode({"h": h, "s": s, "v": v, "lights": widget.lightNames}));
+    }
+    int index = 0;
+    Future<void> playback = player.play();
+    while (index < timesMS.length && !canceled) {
+      final nextTime = timesMS[index];
+      final nextColorJSON = colorsJSONMaps[index];
+      final nextColorColor = colorsColors[index];
+      double waitTime = nextTime - player.position.inMilliseconds;
+      await Future.delayed(Duration(milliseconds: waitTime.floor()));
+      try {
+        await http.post(Uri.parse("${Constants.apiRoot}/set_hsv"),
+            headers: {"Content-Type": "application/json"},
+            body: nextColorJSON
+        );
+      } catch (ignored) {
+        // No-op
       }
+      setState(() {
+        playbackColor = nextColorColor;
+      });
+      index += 1;
+    }
+    if (canceled) {
+      player.stop();
+    } else {
+      await playback;
     }
   }
 
@@ -0,0 +1,477 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+from typing import Any, Union
+
+from kasa import SmartBulb
+import pygame
+from pygame.mixer import music
+
+import rgb_light_control
+
+SYNC_PORT = 11648  # Used for both the UDP clock sync and the TCP show control connection
+SYNC_SAMPLES = 16  # Clock sync exchanges per sync. The one with the lowest round-trip time is used.
+SYNC_SAMPLE_INTERVAL = 0.01
+SYNC_TIMEOUT = 0.5  # Seconds to wait for a single clock sync reply
+RECONNECT_DELAY = 5
+# Largest message between the leader and a follower. A show is sent as one message, and the default limit of 64 KiB
+# only fits a couple thousand light changes.
+MESSAGE_LIMIT = 64 * 1024 * 1024
+REPORT_TIMEOUT = 10  # Seconds after the leader's show ends to wait for followers to report
+
+
+class TimeServerProtocol(asyncio.DatagramProtocol):
+    """Answers clock sync requests with the times the request was received and the reply was sent."""
+
+    def __init__(self):
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        received = time.time()
+        try:
+            t0 = json.loads(data)["t0"]
+        except (ValueError, KeyError, TypeError):
+            return
+        self.transport.sendto(json.dumps({"t0": t0, "t1": received, "t2": time.time()}).encode(), addr)
+
+
+class TimeClientProtocol(asyncio.DatagramProtocol):
+    """Collects clock sync replies along with the time each one arrived."""
+
+    def __init__(self):
+        self.replies = asyncio.Queue()
+
+    def datagram_received(self, data: bytes, addr):
+        received = time.time()
+        try:
+            self.replies.put_nowait((json.loads(data), received))
+        except ValueError:
+            pass
+
+
+async def sync_clock(host: str, port: int = SYNC_PORT, samples: int = SYNC_SAMPLES) -> tuple[float, float]:
+    """Estimate the offset of the leader's clock from this machine's clock, NTP-style.
+
+    Args:
+        host: Host of the leader.
+        port: Port of the leader.
+        samples: Number of exchanges with the leader. The exchange with the lowest round-trip time is used, as it's
+        the least affected by network delays.
+
+    Returns:
+        A tuple containing the offset in seconds to add to this machine's time to get the leader's time, and the
+        round-trip time in seconds of the exchange it was measured with.
+
+    Raises:
+        ConnectionError: If the leader never replied.
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(TimeClientProtocol, remote_addr=(host, port))
+    best = None
+    try:
+        for _ in range(samples):
+            t0 = time.time()
+            transport.sendto(json.dumps({"t0": t0}).encode())
+            try:
+                reply, t3 = await asyncio.wait_for(protocol.replies.get(), SYNC_TIMEOUT)
+                t1 = reply["t1"]
+                t2 = reply["t2"]
+            except (asyncio.TimeoutError, KeyError, TypeError):
+                continue
+            if reply.get("t0") != t0:
+                continue  # A late reply to an earlier exchange
+            rtt = (t3 - t0) - (t2 - t1)
+            offset = ((t1 - t0) + (t2 - t3)) / 2
+            if best is None or rtt < best[1]:
+                best = (offset, rtt)
+            await asyncio.sleep(SYNC_SAMPLE_INTERVAL)
+    finally:
+        transport.close()
+    if best is None:
+        raise ConnectionError(f"The leader at {host}:{port} did not respond to clock sync requests.")
+    return best
+
+
+async def run_timeline(start_at: float, times: list[float], colors: list[list[int]], transition_time: float,
+                       bulbs_to_send: list[SmartBulb]) -> list[float]:
+    """Change the lights at the times in a timeline.
+
+    Args:
+        start_at: The time, in this machine's clock, that the times are relative to.
+        times: The times to change the lights at in seconds.
+        colors: The HSV color to change the lights to at each time.
+        transition_time: The light transition time in seconds.
+        bulbs_to_send: The bulbs to change.
+
+    Returns:
+        The time, in this machine's clock, that each light change was actually sent at.
+    """
+    transition_time = int(transition_time * 1000)  # Convert to int in ms for passing to bulbs
+    sent_at = []
+    for cue_time, hsv in zip(times, colors):
+        await rgb_light_control.wait_until(start_at + cue_time)
+        sent_at.append(time.time())
+        await rgb_light_control.send_hsv(hsv[0], hsv[1], hsv[2], transition=transition_time,
+                                         bulbs_to_send=bulbs_to_send)
+    return sent_at
+
+
+def get_show_bulbs(bulbs_by_ip: dict[str, SmartBulb], lights: Union[list[str], None]) -> list[SmartBulb]:
+    """Get the bulbs a show should change on this node.
+
+    Args:
+        bulbs_by_ip: All bulbs on this node by IP address.
+        lights: IP addresses of the bulbs the show is for, or None for every bulb. IP addresses this node doesn't have
+        are ignored, as they're likely on a different node.
+
+    Returns:
+        The bulbs to change.
+    """
+    if lights is None:
+        return list(bulbs_by_ip.values())
+    return [bulbs_by_ip[light] for light in lights if light in bulbs_by_ip]
+
+
+def summarize_show(start_at: float, times: list[float], reports: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    """Summarize how closely every node followed a show.
+
+    Args:
+        start_at: The time the show started at in the leader's clock.
+        times: The times of the light changes in the show.
+        reports: Reports from every node by name, containing the node's clock 'offset' and 'rtt', and 'sent_at', the
+        times it sent each light change in the leader's clock.
+
+    Returns:
+        A dictionary containing the start time, per-node statistics, and the mean and max skew between the nodes in
+        seconds. The skew of a light change is the spread between the earliest and latest node to send it.
+    """
+    nodes = {}
+    for name, report in reports.items():
+        lateness = [sent - (start_at + cue_time) for sent, cue_time in zip(report["sent_at"], times)]
+        nodes[name] = {"offset": report["offset"], "rtt": report["rtt"],
+                       "mean_lateness": sum(lateness) / len(lateness) if len(lateness) > 0 else 0,
+                       "max_lateness": max(lateness, default=0)}
+    skews = [max(sent) - min(sent) for sent in zip(*[report["sent_at"] for report in reports.values()])]
+    return {"start_at": start_at, "nodes": nodes, "mean_skew": sum(skews) / len(skews) if len(skews) > 0 else 0,
+            "max_skew": max(skews, default=0)}
+
+
+def print_show_summary(summary: dict[str, Any]):
+    """Print a summary from summarize_show().
+
+    Args:
+        summary: The summary to print.
+    """
+    for name, node in summary["nodes"].items():
+        print(f"{name}: clock offset {node['offset'] * 1000:.2f}ms (round-trip {node['rtt'] * 1000:.2f}ms), "
+              f"light changes late by {node['mean_lateness'] * 1000:.2f}ms on average and "
+              f"{node['max_lateness'] * 1000:.2f}ms at most")
+    print(f"Skew between nodes: {summary['mean_skew'] * 1000:.2f}ms on average, {summary['max_skew'] * 1000:.2f}ms at "
+          f"most")
+
+
+def is_valid_report(message: dict[str, Any]) -> bool:
+    """Check that a report from a follower has everything summarize_show() needs.
+
+    Args:
+        message: The report.
+
+    Returns:
+        Whether the report is valid.
+    """
+    sent_at = message.get("sent_at")
+    return (isinstance(message.get("show_id"), int) and isinstance(message.get("name"), str) and
+            isinstance(message.get("offset"), (int, float)) and isinstance(message.get("rtt"), (int, float)) and
+            isinstance(sent_at, list) and all(isinstance(sent, (int, float)) for sent in sent_at))
+
+
+async def send_message(writer: asyncio.StreamWriter, message: dict[str, Any]):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+
+class ShowLeader:
+    """Keeps track of followers and starts shows on all of them at the same time."""
+
+    def __init__(self, bulbs_by_ip: dict[str, SmartBulb], host: str = "0.0.0.0", port: int = SYNC_PORT,
+                 name: str = "leader"):
+        """
+        Args:
+            bulbs_by_ip: All bulbs on the leader by IP address.
+            host: Host to listen on.
+            port: Port to listen on for both clock sync and followers.
+            name: Name of the leader in show summaries.
+        """
+        self.bulbs_by_ip = bulbs_by_ip
+        self.host = host
+        self.port = port
+        self.name = name
+        self.followers: dict[str, asyncio.StreamWriter] = {}
+        self.reports: dict[int, asyncio.Queue] = {}  # Reports from followers for each show that's playing
+        self.show_id = 0
+        self.playing = False
+        self.transport = None
+        self.server = None
+
+    async def start(self):
+        """Start listening for clock sync requests and followers."""
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(TimeServerProtocol, local_addr=(self.host, self.port))
+        self.server = await asyncio.start_server(self.handle_follower, self.host, self.port, limit=MESSAGE_LIMIT)
+
+    def close(self):
+        """Stop listening and disconnect all followers."""
+        if self.transport is not None:
+            self.transport.close()
+        if self.server is not None:
+            self.server.close()
+        for writer in self.followers.values():
+            writer.close()
+
+    async def handle_follower(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        name = None
+        try:
+            hello = json.loads(await reader.readline())
+            name = hello["name"]
+            self.followers[name] = writer
+            print(f"Follower {name} connected.")
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message.get("type") != "report":
+                    continue
+                elif not is_valid_report(message):
+                    print(f"Ignoring an invalid report from follower {name}.")
+                elif message["show_id"] in self.reports:  # Otherwise, it's too late for its show's summary
+                    await self.reports[message["show_id"]].put(message)
+        except (ConnectionError, ValueError, KeyError, TypeError):
+            pass
+        finally:
+            if name is not None and self.followers.get(name) is writer:
+                del self.followers[name]
+                print(f"Follower {name} disconnected.")
+            writer.close()
+
+    async def wait_for_followers(self, count: int):
+        """Wait until at least a number of followers are connected.
+
+        Args:
+            count: Number of followers to wait for.
+        """
+        while len(self.followers) < count:
+            await asyncio.sleep(0.1)
+
+    def new_show(self) -> int:
+        """Reserve the leader for a new show. Only one show can play at a time, as followers play shows one after
+        another, so a second show would start late on every follower.
+
+        Returns:
+            The ID of the new show, to pass to play_show().
+
+        Raises:
+            RuntimeError: If a show is already playing.
+        """
+        if self.playing:
+            raise RuntimeError("A show is already playing. Wait for it to finish before starting another one.")
+        self.playing = True
+        self.show_id += 1
+        self.reports[self.show_id] = asyncio.Queue()
+        return self.show_id
+
+    async def play_show(self, start_at: float, times: list[float], colors: list[list[int]], transition_time: float,
+                        lights: Union[list[str], None] = None, show_id: Union[int, None] = None) -> dict[str, Any]:
+        """Play a show on the leader and every connected follower, starting at the same time on all of them.
+
+        Args:
+            start_at: The time to start the show at in the leader's clock. Followers need time to sync their clocks
+            before this, so it should be at least a second or so in the future.
+            times: The times to change the lights at in seconds, relative to start_at.
+            colors: The HSV color to change the lights to at each time.
+            transition_time: The light transition time in seconds.
+            lights: IP addresses of the bulbs the show is for, or None for every bulb on every node. IP addresses are
+            used rather than aliases, since a bulb's alias is only known once it responds, and may not be unique.
+            show_id: The ID of the show from new_show(), or None to reserve the leader for the show now.
+
+        Returns:
+            The summary of the show from summarize_show().
+
+        Raises:
+            RuntimeError: If show_id is None and a show is already playing.
+        """
+        if show_id is None:
+            show_id = self.new_show()
+        try:
+            return await self.run_show(show_id, start_at, times, colors, transition_time, lights)
+        finally:
+            del self.reports[show_id]
+            self.playing = False
+
+    async def run_show(self, show_id: int, start_at: float, times: list[float], colors: list[list[int]],
+                       transition_time: float, lights: Union[list[str], None]) -> dict[str, Any]:
+        """Send a show to every follower, play it, and collect the followers' reports. See play_show()."""
+        message = {"type": "show", "show_id": show_id, "start_at": start_at, "times": list(times),
+                   "colors": [list(color) for color in colors], "transition_time": transition_time, "lights": lights}
+        followers = list(self.followers.items())
+        for name, writer in followers:
+            try:
+                await send_message(writer, message)
+            except ConnectionError:
+                print(f"Failed to send show to follower {name}.")
+
+        sent_at = await run_timeline(start_at, message["times"], message["colors"], transition_time,
+                                     get_show_bulbs(self.bulbs_by_ip, lights))
+        reports = {self.name: {"offset": 0, "rtt": 0, "sent_at": sent_at}}
+        deadline = time.time() + REPORT_TIMEOUT
+        while len(reports) < len(followers) + 1 and time.time() < deadline:
+            try:
+                report = await asyncio.wait_for(self.reports[show_id].get(), deadline - time.time())
+            except asyncio.TimeoutError:
+                break
+            reports[report["name"]] = report
+        if len(reports) < len(followers) + 1:
+            print(f"Only {len(reports) - 1} of {len(followers)} followers reported on the show.")
+        return summarize_show(start_at, message["times"], reports)
+
+
+async def follow(host: str, bulbs_by_ip: dict[str, SmartBulb], port: int = SYNC_PORT,
+                 name: Union[str, None] = None, max_shows: int = 0):
+    """Connect to a leader and play every show it sends, reconnecting if the connection is lost.
+
+    Args:
+        host: Host of the leader.
+        bulbs_by_ip: All bulbs on this node by IP address.
+        port: Port of the leader.
+        name: Name of this node. Defaults to the hostname and process ID, so multiple followers can run on one machine.
+        max_shows: Number of shows to play before returning, or 0 to never return.
+    """
+    name = name if name is not None else f"{socket.gethostname()}-{os.getpid()}"
+    shows = 0
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port, limit=MESSAGE_LIMIT)
+        except OSError:
+            print(f"Failed to connect to leader at {host}:{port}. Trying again in {RECONNECT_DELAY} seconds.")
+            await asyncio.sleep(RECONNECT_DELAY)
+            continue
+        print(f"Connected to leader at {host}:{port} as {name}.")
+        try:
+            await send_message(writer, {"type": "hello", "name": name})
+            while line := await reader.readline():
+                show = json.loads(line)
+                if show.get("type") != "show":
+                    continue
+                # Sync right before every show, so clock drift between shows doesn't matter
+                offset, rtt = await sync_clock(host, port)
+                print(f"Clock offset from leader is {offset * 1000:.2f}ms (round-trip {rtt * 1000:.2f}ms).")
+                sent_at = await run_timeline(show["start_at"] - offset, show["times"], show["colors"],
+                                             show["transition_time"], get_show_bulbs(bulbs_by_ip, show["lights"]))
+                await send_message(writer, {"type": "report", "show_id": show["show_id"], "name": name,
+                                            "offset": offset, "rtt": rtt,
+                                            "sent_at": [sent + offset for sent in sent_at]})
+                shows += 1
+                if shows == max_shows:
+                    writer.close()
+                    return
+        except (ConnectionError, ValueError, KeyError, TypeError) as e:
+            print(f"Lost connection to leader: {e}")
+        writer.close()
+        print(f"Disconnected from leader. Reconnecting in {RECONNECT_DELAY} seconds.")
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+async def load_node_bulbs() -> dict[str, SmartBulb]:
+    """Load the bulbs in lights.txt if it exists, so a node can also run without any bulbs for testing.
+
+    Returns:
+        The bulbs by IP address.
+    """
+    if not os.path.isfile("lights.txt"):
+        print("lights.txt not found, so no lights will be changed on this node.")
+        return {}
+    await rgb_light_control.load_bulbs()
+    return {bulb.host: bulb for bulb in rgb_light_control.bulbs}
+
+
+async def run_leader(args: list[str]):
+    """Run a show as the leader from command line arguments.
+
+    Args:
+        args: Arguments after 'leader'.
+    """
+    port = rgb_light_control.pop_int_option(args, "port", SYNC_PORT)
+    follower_count = rgb_light_control.pop_int_option(args, "followers", 1)
+    lead_time = rgb_light_control.pop_int_option(args, "lead", 3)
+    profile = rgb_light_control.pop_option(args, "profile", "default")
+    silent = "--silent" in args
+    if silent:
+        args.remove("--silent")
+    if len(args) < 3:
+        rgb_light_control.error_exit("Please specify a mode (cycle or gradient), an RGB color string, a filepath to "
+                                     "the music, and optionally, --followers=N to wait for N followers, --lead=N to "
+                                     "start the show N seconds after sending it, --port=N, --profile=fast, and "
+                                     "--silent to not play the music on this machine.")
+    colors = rgb_light_control.convert_rgb_colors_string(args[1])
+    filepath = os.path.expanduser(os.path.expandvars(args[2]))
+    if not os.path.isfile(filepath):
+        rgb_light_control.error_exit(f"{filepath} is not a file!")
+
+    bulbs_by_ip = await load_node_bulbs()
+    send_delay = await rgb_light_control.estimate_send_delay() if len(bulbs_by_ip) > 0 else 0
+    times, colors, transition_time = await rgb_light_control.calculate_music_timings(args[0], colors, filepath,
+                                                                                     send_delay, profile)
+    leader = ShowLeader(bulbs_by_ip, port=port)
+    await leader.start()
+    print(f"Waiting for {follower_count} followers to connect on port {port}.")
+    await leader.wait_for_followers(follower_count)
+    start_at = time.time() + lead_time
+    if not silent:
+        pygame.init()
+        music.load(filepath)
+
+        async def play_music():
+            await rgb_light_control.wait_until(start_at)
+            music.play()
+        music_task = asyncio.create_task(play_music())
+    try:
+        summary = await leader.play_show(start_at, times, colors, transition_time)
+        print_show_summary(summary)
+        if not silent:
+            await music_task
+            while music.get_busy():
+                await asyncio.sleep(0.1)
+    finally:
+        if not silent:
+            music_task.cancel()
+            music.stop()  # Only does anything if the show was stopped early
+        leader.close()
+
+
+async def main():
+    """Main entrypoint"""
+    args = sys.argv[1:]
+    if len(args) == 0 or args[0] not in ["leader", "follower"]:
+        rgb_light_control.error_exit("Please specify either leader or follower.")
+    elif args[0] == "leader":
+        await run_leader(args[1:])
+    else:
+        args = args[1:]
+        port = rgb_light_control.pop_int_option(args, "port", SYNC_PORT)
+        max_shows = rgb_light_control.pop_int_option(args, "shows", 0)
+        name = rgb_light_control.pop_option(args, "name", "")
+        if len(args) < 1:
+            rgb_light_control.error_exit("Please specify the host of the leader, and optionally, --port=N, --name=NAME, "
+                                         "and --shows=N to exit after N shows.")
+        await follow(args[0], await load_node_bulbs(), port, name if name != "" else None, max_shows)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except rgb_light_control.RGBLightControlException as e:
+        print(e)
+        sys.exit(1)
@@ -1,4 +1,4 @@
-from quart import Quart, request, jsonify, send_from_directory
+from quart import Quart, Response, request, jsonify, send_file, send_from_directory
 import os
 import kasa
 from typing import Any, Union
@@ -7,29 +7,82 @@ import json
 from collections import namedtuple
 import base64
 from io import BytesIO
+import gzip
+import struct
+import numpy as np
+import hashlib
+import mimetypes
+import re
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Brotli is optional. Without it, static files are only precompressed with gzip.
 
 import rgb_light_control
+import show_sync
 
 FileFromJSON = namedtuple("FileFromJSON", ["filename", "data"])
+StaticAsset = namedtuple("StaticAsset", ["mimetype", "cache_control", "variants", "mtime_ns", "size"])
+StaticVariant = namedtuple("StaticVariant", ["path", "etag", "data"])
 REQUEST_METHODS: list[str] = ["GET", "POST"]
+JSON_MIMETYPE = "application/json"
+# Binary music timings, all little-endian: the magic bytes "RGBT", the format version (uint32), the number of light
+# changes (uint32), and the transition time in seconds (float32), followed by the time of each light change in seconds
+# (float32 each), then the HSV color of each light change (three uint16s each).
+TIMINGS_MIMETYPE = "application/vnd.rgb-light-control.timings"
+TIMINGS_MAGIC = b"RGBT"
+TIMINGS_VERSION = 1
+GZIP_MIN_SIZE = 1024  # Responses smaller than this aren't worth compressing
+WEB_BUILD_DIR = "rgb_light_control_ui/build/web"
+STATIC_CACHE_MAX_SIZE = 256 * 1024  # Static files (or compressed versions of them) this small are kept in memory
+COMPRESSIBLE_EXTENSIONS: tuple[str, ...] = (".html", ".js", ".mjs", ".css", ".json", ".wasm", ".svg", ".txt", ".map",
+                                            ".ttf", ".otf", ".frag")
+# Filenames with a content hash in them, such as "main.0123abcd.js", never change, so they can be cached forever.
+# Everything else has to be revalidated with its ETag.
+HASHED_ASSET_PATTERN = re.compile(r"[.-][0-9a-f]{8,}\.[^/]+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+mimetypes.add_type("text/javascript", ".mjs")
+mimetypes.add_type("application/wasm", ".wasm")
+static_assets: dict[str, StaticAsset] = {}
 
 discovery_ip = "255.255.255.255"
+light_groups: dict[str, list[str]] = {}
+sync_role = ""
+sync_leader_host = ""
+sync_port = show_sync.SYNC_PORT
 if os.path.isfile("web_server_config.txt"):
     with open("web_server_config.txt", "r") as f:
         lines: list[str] = f.readlines()
         for line in lines:
             if line.startswith("discovery_ip="):
                 discovery_ip = line[len("discovery_ip="):].strip()
+            elif line.startswith("sync_role="):
+                sync_role = line[len("sync_role="):].strip()
+            elif line.startswith("sync_leader_host="):
+                sync_leader_host = line[len("sync_leader_host="):].strip()
+            elif line.startswith("sync_port="):
+                sync_port = int(line[len("sync_port="):].strip())
+            elif line.startswith("group_") and "=" in line:
+                group_name, _, group_lights = line[len("group_"):].partition("=")
+                light_groups[group_name.strip()] = [light.strip() for light in group_lights.split(",")]
 
 lghts = asyncio.run(kasa.Discover.discover(target=discovery_ip))
 all_bulbs = {}
+all_bulbs_by_ip = {}  # Show sync picks bulbs by IP address, the same as nodes run from the command line
 all_bulbs_data = []
 for ip, lght in lghts.items():
     if isinstance(lght, kasa.SmartBulb) and lght.is_color:
         all_bulbs[lght.alias] = lght
+        all_bulbs_by_ip[ip] = lght
         all_bulbs_data.append({"ip": ip, "name": lght.alias})
 
 app: Quart = Quart(__name__)
+show_leader: Union[show_sync.ShowLeader, None] = None
+last_show_summary: Union[dict, None] = None
 
 
 def make_message(message: str, status_code: int = 200, data: Any = None):
@@ -39,6 +92,170 @@ def make_message(message: str, status_code: int = 200, data: Any = None):
         return jsonify({"message": message}), status_code
 
 
+def make_compressed_response(body: bytes, mimetype: str, status_code: int = 200) -> Response:
+    """Make a response, gzip compressing it if it's large and the client accepts gzip.
+
+    Args:
+        body: The body of the response.
+        mimetype: The mimetype of the body.
+        status_code: The status code of the response.
+
+    Returns:
+        The response.
+    """
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if len(body) >= GZIP_MIN_SIZE and request.accept_encodings["gzip"] > 0:
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, status=status_code, mimetype=mimetype, headers=headers)
+
+
+def encode_timings(times: list[float], colors: list[tuple[int, int, int]], transition_time: float) -> bytes:
+    """Encode music timings into the binary format described by TIMINGS_MIMETYPE.
+
+    Args:
+        times: The times to change the lights at in seconds.
+        colors: The HSV color to change the lights to at each time.
+        transition_time: The light transition time in seconds.
+
+    Returns:
+        The encoded music timings.
+    """
+    header = struct.pack("<4sIIf", TIMINGS_MAGIC, TIMINGS_VERSION, len(times), transition_time)
+    return (header + np.asarray(times, dtype="<f4").tobytes() +
+            np.asarray(colors, dtype="<u2").reshape(-1).tobytes())
+
+
+def precompress(path: str, data: bytes, extension: str, compress) -> Union[str, None]:
+    """Write a compressed copy of a static file next to it, unless an up-to-date one already exists.
+
+    Args:
+        path: Path to the static file.
+        data: Contents of the static file.
+        extension: Extension to add to the path for the compressed copy, such as '.gz'.
+        compress: Function that compresses bytes.
+
+    Returns:
+        The path to the compressed copy, or None if compressing doesn't make the file smaller.
+    """
+    compressed_path = path + extension
+    if not os.path.isfile(compressed_path) or os.path.getmtime(compressed_path) < os.path.getmtime(path):
+        compressed = compress(data)
+        if len(compressed) >= len(data):
+            return None
+        with open(compressed_path, "wb") as f:
+            f.write(compressed)
+    elif os.path.getsize(compressed_path) >= len(data):
+        return None
+    return compressed_path
+
+
+def load_static_variant(path: str, etag: str) -> StaticVariant:
+    """Load a version of a static file, keeping its contents in memory if it's small.
+
+    Args:
+        path: Path to the file to serve.
+        etag: The strong ETag of the file, not including quotes.
+
+    Returns:
+        The static variant.
+    """
+    data = None
+    if os.path.getsize(path) <= STATIC_CACHE_MAX_SIZE:
+        with open(path, "rb") as f:
+            data = f.read()
+    return StaticVariant(path=path, etag=etag, data=data)
+
+
+def load_static_asset(path: str) -> StaticAsset:
+    """Index a file from the Flutter web build, precompressing it if worthwhile.
+
+    Args:
+        path: Path to the file.
+
+    Returns:
+        The static asset.
+    """
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    variants = {"identity": load_static_variant(path, digest)}
+    filename = os.path.basename(path)
+    if filename.endswith(COMPRESSIBLE_EXTENSIONS) and len(data) >= GZIP_MIN_SIZE:
+        gzip_path = precompress(path, data, ".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))
+        if gzip_path is not None:
+            variants["gzip"] = load_static_variant(gzip_path, f"{digest}-gzip")
+        if brotli is not None:
+            brotli_path = precompress(path, data, ".br", lambda d: brotli.compress(d, quality=11))
+            if brotli_path is not None:
+                variants["br"] = load_static_variant(brotli_path, f"{digest}-br")
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    cache_control = IMMUTABLE_CACHE_CONTROL if HASHED_ASSET_PATTERN.search(filename) else REVALIDATE_CACHE_CONTROL
+    return StaticAsset(mimetype=mimetype, cache_control=cache_control, variants=variants, mtime_ns=stat.st_mtime_ns,
+                       size=stat.st_size)
+
+
+def load_static_assets():
+    """Index the Flutter web build, precompressing its files, so they can be served with caching headers."""
+    static_assets.clear()
+    if not os.path.isdir(WEB_BUILD_DIR):
+        return
+    for root, _, filenames in os.walk(WEB_BUILD_DIR):
+        for filename in filenames:
+            if filename.endswith((".gz", ".br")):
+                continue
+            path = os.path.join(root, filename)
+            url_path = os.path.relpath(path, WEB_BUILD_DIR).replace(os.sep, "/")
+            static_assets[url_path] = load_static_asset(path)
+
+
+async def send_static(path: str):
+    """Send a file from the Flutter web build, compressed and with caching headers if it was indexed at startup.
+
+    Files that changed since they were indexed, such as from running flutter build web while the server is running,
+    are indexed again before being sent, so the ETags and compressed copies always match the file on disk.
+
+    Args:
+        path: Path to the file, relative to the web build directory.
+
+    Returns:
+        The response.
+    """
+    asset = static_assets.get(path)
+    if asset is not None:
+        source_path = asset.variants["identity"].path
+        try:
+            stat = os.stat(source_path)
+            if stat.st_mtime_ns != asset.mtime_ns or stat.st_size != asset.size:
+                asset = await asyncio.to_thread(load_static_asset, source_path)
+                static_assets[path] = asset
+        except OSError:
+            # Removed from the build, so let the fallback below decide what to send
+            static_assets.pop(path, None)
+            asset = None
+    if asset is None:
+        # Not indexed, such as if a file was added to the site after the server started
+        return await send_from_directory(WEB_BUILD_DIR, path)
+    encoding = "identity"
+    for candidate in ["br", "gzip"]:
+        if candidate in asset.variants and request.accept_encodings[candidate] > 0:
+            encoding = candidate
+            break
+    variant = asset.variants[encoding]
+    headers = {"ETag": f'"{variant.etag}"', "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    if request.if_none_match.contains_weak(variant.etag):
+        return Response(b"", status=304, headers=headers)
+    if variant.data is not None:
+        return Response(variant.data, mimetype=asset.mimetype, headers=headers)
+    # Stream large files from disk rather than reading them into memory, which also supports Range requests
+    response = await send_file(variant.path, mimetype=asset.mimetype, add_etags=False)
+    response.headers.update(headers)
+    return await response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+
+
 async def get_data() -> Union[dict, None]:
     """Get a dictionary of data from the request, or None if data isn't provided.
 
@@ -56,6 +273,31 @@ async def get_data() -> Union[dict, None]:
         return None
 
 
+async def get_music_file(data: dict) -> tuple[Any, str]:
+    """Get the uploaded music file from the request, either as a file upload or base64 in the request's data.
+
+    Args:
+        data: The data from the request, from get_data().
+
+    Returns:
+        A tuple containing the music file as a file-like object and an empty string, or None and an error message if
+        no valid file was uploaded.
+    """
+    files = await request.files
+    if len(files) == 0 or "file" not in files:
+        if "file" in data:
+            file = data["file"]
+            files = {"file": FileFromJSON(filename=file["filename"], data=base64.b64decode(file["data"]))}
+        else:
+            return None, "No 'file' supplied."
+    file = files["file"]
+    if file.filename == "":
+        return None, "Your music file does not have a name! Did you not select one?"
+    elif isinstance(file, FileFromJSON):
+        file = BytesIO(file.data)
+    return file, ""
+
+
 def get_list(lst: Union[str, list]):
     if isinstance(lst, str):
         return lst.split(",")
@@ -90,36 +332,118 @@ async def calculate_music_timings():
         if request.method == "GET":
             return make_message("Due to requiring file uploads, this endpoint only accepts POST requests.", status_code=405)
         data = await get_data()
-        files = await request.files
-        if len(files) == 0 or "file" not in files:
-            if "file" in data:
-                file = data["file"]
-                files = {"file": FileFromJSON(filename=file["filename"], data=base64.b64decode(file["data"]))}
-            else:
-                return make_message("No 'file' supplied.", status_code=400)
-        file = files["file"]
-        if file.filename == "":
-            return make_message("Your music file does not have a name! Did you not select one?", status_code=400)
-        elif isinstance(file, FileFromJSON):
-            file = BytesIO(file.data)
+        file, err = await get_music_file(data)
+        if file is None:
+            return make_message(err, status_code=400)
 
         mode = data["mode"]
         if mode not in ["cycle", "gradient"]:
             return make_message("Mode must be either 'cycle' or 'gradient'.", status_code=400)
 
+        profile = data.get("profile", "default")
+        if profile not in rgb_light_control.ANALYSIS_PROFILES:
+            return make_message(f"Profile must be one of {", ".join(rgb_light_control.ANALYSIS_PROFILES)}.",
+                                status_code=400)
+
         colors = get_list(data["colors"])
         send_delay = float(data["send_delay"])
 
         try:
-            times, colors, transition_time = await rgb_light_control.calculate_music_timings(mode, colors, file, send_delay)
+            times, colors, transition_time = await rgb_light_control.calculate_music_timings(mode, colors, file,
+                                                                                             send_delay, profile)
         except ValueError:
             return make_message("Invalid audio file!", status_code=400)
-        data = {"times": times, "colors": colors, "transition_time": transition_time}
-        return make_message("Calculated music timings!", data=data)
+        if request.accept_mimetypes.best_match([JSON_MIMETYPE, TIMINGS_MIMETYPE]) == TIMINGS_MIMETYPE:
+            return make_compressed_response(encode_timings(times, colors, transition_time), TIMINGS_MIMETYPE)
+        data = {"times": [float(t) for t in times], "colors": colors, "transition_time": float(transition_time)}
+        body = json.dumps({"message": "Calculated music timings!", "data": data}).encode()
+        return make_compressed_response(body, JSON_MIMETYPE)
     except (KeyError, TypeError, ValueError):
         return make_message("'mode', 'colors', and/or 'send_delay' were not provided or invalid.")
 
 
+@app.route("/api/calculate_music_bands", methods=REQUEST_METHODS)
+async def calculate_music_bands():
+    try:
+        if request.method == "GET":
+            return make_message("Due to requiring file uploads, this endpoint only accepts POST requests.", status_code=405)
+        data = await get_data()
+        file, err = await get_music_file(data)
+        if file is None:
+            return make_message(err, status_code=400)
+
+        profile = data.get("profile", "default")
+        if profile not in rgb_light_control.ANALYSIS_PROFILES:
+            return make_message(f"Profile must be one of {", ".join(rgb_light_control.ANALYSIS_PROFILES)}.",
+                                status_code=400)
+
+        bands = rgb_light_control.parse_bands(data.get("bands", rgb_light_control.DEFAULT_BANDS))
+        groups = data.get("groups", light_groups)
+        colors = get_list(data["colors"])
+        send_delay = float(data["send_delay"])
+
+        try:
+            band_timings, transition_time = await rgb_light_control.calculate_music_band_timings(colors, file,
+                                                                                                 send_delay, bands,
+                                                                                                 profile)
+        except ValueError:
+            return make_message("Invalid audio file!", status_code=400)
+        bands_data = {}
+        for name, (times, band_colors) in band_timings.items():
+            lights = [light for light in get_list(groups.get(name, [])) if light in all_bulbs]
+            bands_data[name] = {"times": times, "colors": band_colors, "lights": lights}
+        data = {"bands": bands_data, "transition_time": float(transition_time)}
+        body = json.dumps({"message": "Calculated music timings for each band!", "data": data}).encode()
+        return make_compressed_response(body, JSON_MIMETYPE)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return make_message("'colors' and/or 'send_delay' were not provided or invalid, or 'bands' and/or 'groups' "
+                            "were invalid.", status_code=400)
+
+
+@app.route("/api/sync/start_show", methods=REQUEST_METHODS)
+async def sync_start_show():
+    if show_leader is None:
+        return make_message("This server is not a sync leader. Set sync_role=leader in web_server_config.txt.",
+                            status_code=400)
+    try:
+        data = await get_data()
+        times = [float(t) for t in get_list(data["times"])]
+        colors = [[int(c) for c in color] for color in data["colors"]]
+        transition_time = float(data["transition_time"])
+        lead_time = float(data.get("lead_time", 3))
+        lights = get_list(data["lights"]) if "lights" in data else None
+        if len(times) != len(colors) or any(len(color) != 3 for color in colors):
+            return make_message("'times' and 'colors' must be the same length, with 3 values per color.",
+                                status_code=400)
+        elif lead_time < 1:
+            return make_message("'lead_time' must be at least 1 second, so followers can sync their clocks.",
+                                status_code=400)
+    except (KeyError, TypeError, ValueError):
+        return make_message("Please provide 'times', 'colors', 'transition_time', and optionally 'lights' and "
+                            "'lead_time' in a valid format.", status_code=400)
+
+    try:
+        show_id = show_leader.new_show()
+    except RuntimeError as e:
+        return make_message(str(e), status_code=409)
+    start_at = time.time() + lead_time
+
+    async def play_show():
+        global last_show_summary
+        last_show_summary = await show_leader.play_show(start_at, times, colors, transition_time, lights, show_id)
+        show_sync.print_show_summary(last_show_summary)
+    app.add_background_task(play_show)
+    return make_message("Show started!", data={"start_at": start_at, "starts_in": lead_time,
+                                               "followers": list(show_leader.followers)})
+
+
+@app.route("/api/sync/status", methods=REQUEST_METHODS)
+async def sync_status():
+    followers = list(show_leader.followers) if show_leader is not None else []
+    return make_message("Got sync status!", data={"role": sync_role, "followers": followers,
+                                                  "last_show": last_show_summary})
+
+
 @app.route("/api/estimate_light_delay", methods=REQUEST_METHODS)
 async def estimate_light_delay():
     try:
@@ -171,14 +495,31 @@ async def ping():
     return make_message("Pong!")
 
 
+@app.before_serving
+async def startup():
+    global show_leader
+    await asyncio.to_thread(load_static_assets)
+    if sync_role == "leader":
+        show_leader = show_sync.ShowLeader(all_bulbs_by_ip, port=sync_port)
+        await show_leader.start()
+    elif sync_role == "follower":
+        app.add_background_task(show_sync.follow, sync_leader_host, all_bulbs_by_ip, sync_port)
+
+
+@app.after_serving
+async def shutdown():
+    if show_leader is not None:
+        show_leader.close()
+
+
 @app.route("/")
 async def home():
-    return await send_from_directory("rgb_light_control_ui/build/web", "index.html")
+    return await send_static("index.html")
 
 
 @app.route("/<path:path>")
 async def site(path):
-    return await send_from_directory("rgb_light_control_ui/build/web", path)
+    return await send_static(path)
 
 
 if __name__ == "__main__":